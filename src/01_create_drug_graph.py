@@ -1,43 +1,86 @@
+import argparse
+import hashlib
+import json
+import re
 import shutil
+import tempfile
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
 from pathlib import Path
 from typing import List
 
 import kuzu
 import polars as pl
 
+from ingest_metrics import IngestMetrics, default_report_path, instrumented, record_stage
+
+# Unit separator control character, which never occurs in the extracted text
+SPLIT_DELIMITER = "\x1f"
+
+# The streaming engine of the pinned polars is deprecated in favor of a new one, but it is
+# still the one that bounds the memory of the CAN_CAUSE product
+warnings.filterwarnings("ignore", message="The old streaming engine", category=DeprecationWarning)
+
+# Rows of a streamed extraction, one per line, have the same fields as the JSON tables
+DRUG_SCHEMA = pl.Schema(
+    {
+        "condition": pl.String,
+        "drug": pl.List(pl.Struct({"generic_name": pl.String, "brand_names": pl.List(pl.String)})),
+        "side_effects": pl.List(pl.String),
+    }
+)
+
 
 def process_condition_column(
-    df: pl.DataFrame, column: str, separators: List[str] = [" or ", "/"], strip: bool = True
+    df: pl.DataFrame,
+    column: str,
+    separators: List[str] = [" or ", "/"],
+    strip: bool = True,
+    strip_chars: str | None = None,
+    collapse_whitespace: bool = False,
+    remove_chars: str = "",
 ) -> pl.DataFrame:
     """
     Explode the condition column with multiple separators into multiple rows.
-    """
-    # Start with the initial dataframe
-    result = df
 
-    # Create expression for the initial transformation
+    All separators are matched by one regex, so the column is split and exploded once no
+    matter how many separators there are. Optional normalization: `remove_chars` (e.g. "®™")
+    are deleted wherever they occur, `collapse_whitespace` turns runs of whitespace into a
+    single space, and `strip` trims `strip_chars` (whitespace when None) from both ends.
+    """
     expr = pl.col(column).str.to_lowercase()
-
-    # First transformation
-    result = result.with_columns(expr.alias(column))
-
-    # Process each separator with separate explode operations
-    for separator in separators:
-        result = result.with_columns(pl.col(column).str.split(separator)).explode(column)
-
-    # Add stripping if needed
+    if remove_chars:
+        expr = expr.str.replace_all(f"[{re.escape(remove_chars)}]", "")
+    if separators:
+        # Polars only splits on a literal, so every separator is first mapped to one delimiter
+        pattern = "|".join(re.escape(separator) for separator in separators)
+        expr = expr.str.replace_all(pattern, SPLIT_DELIMITER).str.split(SPLIT_DELIMITER)
+    result = df.with_columns(expr.alias(column))
+    if separators:
+        result = result.explode(column)
+
+    if collapse_whitespace:
+        result = result.with_columns(pl.col(column).str.replace_all(r"\s+", " "))
     if strip:
-        result = result.with_columns(pl.col(column).str.strip_chars())
+        result = result.with_columns(pl.col(column).str.strip_chars(strip_chars))
 
     return result
 
 
 def create_node_tables(conn: kuzu.Connection) -> None:
-    # Create drug and side effects graph
-    conn.execute("""CREATE NODE TABLE IF NOT EXISTS DrugGeneric (name STRING PRIMARY KEY)""")
-    conn.execute("""CREATE NODE TABLE IF NOT EXISTS DrugBrand (name STRING PRIMARY KEY)""")
-    conn.execute("""CREATE NODE TABLE IF NOT EXISTS Symptom (name STRING PRIMARY KEY)""")
-    conn.execute("""CREATE NODE TABLE IF NOT EXISTS Condition (name STRING PRIMARY KEY)""")
+    # Create drug and side effects graph, keyed by dense integer ids from the entity dictionary
+    conn.execute(
+        """CREATE NODE TABLE IF NOT EXISTS DrugGeneric (id INT64 PRIMARY KEY, name STRING)"""
+    )
+    conn.execute(
+        """CREATE NODE TABLE IF NOT EXISTS DrugBrand (id INT64 PRIMARY KEY, name STRING)"""
+    )
+    conn.execute("""CREATE NODE TABLE IF NOT EXISTS Symptom (id INT64 PRIMARY KEY, name STRING)""")
+    conn.execute(
+        """CREATE NODE TABLE IF NOT EXISTS Condition (id INT64 PRIMARY KEY, name STRING)"""
+    )
 
 
 def create_rel_tables(conn) -> None:
@@ -46,178 +89,541 @@ def create_rel_tables(conn) -> None:
     conn.execute("""CREATE REL TABLE IF NOT EXISTS IS_TREATED_BY (FROM Condition TO DrugGeneric)""")
 
 
-def merge_condition_nodes(df, conn) -> None:
-    conditions_df = df.select(pl.col("condition")).unique()
+# Staged frame -> Kuzu table, in an order where node tables are loaded before the
+# relationship tables that reference them. Relationship frames list FROM then TO keys.
+COPY_ORDER = [
+    ("conditions", "Condition"),
+    ("symptoms", "Symptom"),
+    ("generic_drugs", "DrugGeneric"),
+    ("brand_drugs", "DrugBrand"),
+    ("condition_drug", "IS_TREATED_BY"),
+    ("generic_drug_brand", "HAS_BRAND"),
+    ("symptom_drug", "CAN_CAUSE"),
+]
+
+# Name column of the staged frames -> node table whose entity dictionary encodes it
+KEY_TABLES = {
+    "condition": "Condition",
+    "symptom": "Symptom",
+    "generic_name": "DrugGeneric",
+    "brand_name": "DrugBrand",
+}
+
+# Staged node frame -> the name column it holds
+NODE_KEYS = {
+    "conditions": "condition",
+    "symptoms": "symptom",
+    "generic_drugs": "generic_name",
+    "brand_drugs": "brand_name",
+}
+
+
+def stage_drug_frames(df: pl.DataFrame) -> dict[str, pl.DataFrame]:
+    """
+    Build every node and edge frame for the drug graph from a single lazy plan.
+
+    The condition column is split once and the drug/side-effect lists are exploded once,
+    with all names normalized to lowercase. The seven frames share that common plan and
+    are collected together, so the merge functions below only have to do the Kuzu writes.
+    """
+    base = (
+        process_condition_column(df, "condition")
+        .lazy()
+        .select(pl.col("condition"), pl.col("side_effects"), pl.col("drug"))
+    )
+    # One row per (condition, generic drug) with its brand names still nested
+    drugs = (
+        base.select(pl.col("condition"), pl.col("drug"))
+        .explode("drug")
+        .select(
+            pl.col("condition"),
+            pl.col("drug").struct.field("generic_name").str.to_lowercase().alias("generic_name"),
+            pl.col("drug").struct.field("brand_names").alias("brand_names"),
+        )
+    )
+    brands = (
+        drugs.select(pl.col("generic_name"), pl.col("brand_names"))
+        .explode("brand_names")
+        .filter(pl.col("brand_names") != "")  # Filter out empty brand names
+        .select(
+            pl.col("generic_name"),
+            pl.col("brand_names").str.to_lowercase().alias("brand_name"),
+        )
+    )
+    names = [
+        "conditions",
+        "symptoms",
+        "generic_drugs",
+        "brand_drugs",
+        "condition_drug",
+        "generic_drug_brand",
+    ]
+    plans = [
+        base.select(pl.col("condition")).unique(),
+        base.select(pl.col("side_effects").explode().str.to_lowercase().alias("symptom")).unique(),
+        drugs.select(pl.col("generic_name")).unique(),
+        brands.select(pl.col("brand_name")).unique(),
+        drugs.select(pl.col("condition"), pl.col("generic_name")).unique(),
+        brands.unique(),
+    ]
+    frames = dict(zip(names, pl.collect_all(plans)))
+    # CAN_CAUSE does not depend on the condition, so it is staged from the unsplit rows
+    frames["symptom_drug"] = stage_symptom_drug_frame(df)
+    return frames
+
+
+def stage_symptom_drug_frame(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Build the CAN_CAUSE edge frame without materializing the full side effect x drug product.
+
+    Only the two key lists are projected, normalized and deduplicated within each row, and
+    rows with identical lists are collapsed before exploding. The plan is collected with the
+    streaming engine, so the exploded product is deduplicated in chunks rather than held in
+    memory at once. The stage record compares the unique edges (rows out) with the raw side
+    effect x drug product (rows in).
+    """
+    expected = df.select((pl.col("side_effects").list.len() * pl.col("drug").list.len()).sum())
+    with record_stage("stage_symptom_drug_frame", rows_in=expected.item()) as record:
+        edges = (
+            df.lazy()
+            .select(
+                pl.col("side_effects")
+                .list.eval(pl.element().str.to_lowercase())
+                .list.unique()
+                .list.sort()
+                .alias("symptom"),
+                pl.col("drug")
+                .list.eval(pl.element().struct.field("generic_name").str.to_lowercase())
+                .list.unique()
+                .list.sort()
+                .alias("generic_name"),
+            )
+            .unique()
+            .explode("symptom")
+            .explode("generic_name")
+            .select(pl.col("generic_name"), pl.col("symptom"))
+            .drop_nulls()
+            .unique()
+            .collect(streaming=True)
+        )
+        record["rows_out"] = len(edges)
+    return edges
+
+
+@instrumented
+def merge_condition_nodes(conditions_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     conn.execute(
         """
         LOAD FROM conditions_df
-        MERGE (c:Condition {name: condition})
+        MERGE (c:Condition {id: condition_id}) ON CREATE SET c.name = condition
         """
     )
     print(f"Merged {len(conditions_df)} conditions into the graph")
+    return len(conditions_df)
 
 
-def merge_symptom_nodes(df, conn) -> None:
-    symptoms_df = df.select(
-        pl.col("side_effects").explode().str.to_lowercase().alias("symptom")
-    ).unique()
+@instrumented
+def merge_symptom_nodes(symptoms_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     conn.execute(
         """
         LOAD FROM symptoms_df
-        MERGE (s:Symptom {name: symptom})
+        MERGE (s:Symptom {id: symptom_id}) ON CREATE SET s.name = symptom
         """
     )
     print(f"Merged {len(symptoms_df)} symptoms into the graph")
+    return len(symptoms_df)
 
 
-def merge_generic_drug_nodes(df, conn) -> None:
-    # Extract generic drug names from the nested structure
-    generic_drugs_df = (
-        df.explode("drug")
-        .select(
-            pl.col("drug").struct.field("generic_name").str.to_lowercase().alias("generic_names")
-        )
-        .unique()
-    )
+@instrumented
+def merge_generic_drug_nodes(generic_drugs_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     conn.execute(
         """
         LOAD FROM generic_drugs_df
-        MERGE (d:DrugGeneric {name: generic_names})
+        MERGE (d:DrugGeneric {id: generic_name_id}) ON CREATE SET d.name = generic_name
         """
     )
     print(f"Merged {len(generic_drugs_df)} generic drugs into the graph")
+    return len(generic_drugs_df)
 
 
-def merge_brand_drug_nodes(df, conn) -> None:
-    # Extract brand drug names from the nested structure
-    brand_drugs_df = (
-        df.explode("drug")
-        .select(pl.col("drug").struct.field("brand_names").alias("brand_names"))
-        .explode("brand_names")
-        .filter(pl.col("brand_names") != "")  # Filter out empty brand names
-        .select(pl.col("brand_names").str.to_lowercase())
-        .unique()
-    )
+@instrumented
+def merge_brand_drug_nodes(brand_drugs_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     conn.execute(
         """
         LOAD FROM brand_drugs_df
-        MERGE (d:DrugBrand {name: brand_names})
+        MERGE (d:DrugBrand {id: brand_name_id}) ON CREATE SET d.name = brand_name
         """
     )
     print(f"Merged {len(brand_drugs_df)} brand drugs into the graph")
+    return len(brand_drugs_df)
 
 
-def merge_condition_generic_drug_rel(df, conn) -> None:
-    condition_drug_df = (
-        df.explode("drug").select(
-            [
-                pl.col("condition").str.to_lowercase().alias("condition"),
-                pl.col("drug")
-                .struct.field("generic_name")
-                .str.to_lowercase()
-                .alias("generic_name"),
-            ]
-        )
-    ).unique()
-
+@instrumented
+def merge_condition_generic_drug_rel(condition_drug_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     response = conn.execute(
         """
         LOAD FROM condition_drug_df
-        MATCH (d:Condition {name: condition}), (g:DrugGeneric {name: generic_name})
+        MATCH (d:Condition {id: condition_id})
+        MATCH (g:DrugGeneric {id: generic_name_id})
         MERGE (d)-[:IS_TREATED_BY]->(g)
         RETURN COUNT(*)
         """
     )
     count = response.get_next()[0]
     print(f"Merged {count} condition-generic drug relationships into the graph")
+    return count
 
 
-def merge_generic_drug_brand_rel(df, conn) -> None:
-    # Merge generic drug and brand drug relationships
-    # First, create a dataframe with exploded drugs and processed conditions
-    df_with_drugs = df.explode("drug").with_columns(
-        [
-            pl.col("drug").struct.field("generic_name").str.to_lowercase().alias("generic_name"),
-            pl.col("drug").struct.field("brand_names").alias("brand_names"),
-            pl.col("condition").str.to_lowercase().str.strip_chars().alias("condition"),
-        ]
-    )
-
-    df_with_conditions = df_with_drugs.select(["generic_name", "brand_names", "condition"])
-
-    # Finally, explode brand names and create the final dataframe
-    generic_drug_brand_df = (
-        df_with_conditions.explode("brand_names")
-        .filter(pl.col("brand_names") != "")  # Filter out empty brand names
-        .with_columns(pl.col("brand_names").str.to_lowercase().alias("brand_name"))
-        .select(["generic_name", "brand_name", "condition"])
-    ).unique()
-
+@instrumented
+def merge_generic_drug_brand_rel(generic_drug_brand_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     response = conn.execute(
         """
         LOAD FROM generic_drug_brand_df
-        MATCH (d1:DrugGeneric {name: generic_name}), (d2:DrugBrand {name: brand_name})
+        MATCH (d1:DrugGeneric {id: generic_name_id})
+        MATCH (d2:DrugBrand {id: brand_name_id})
         MERGE (d1)-[:HAS_BRAND]->(d2)
         RETURN COUNT(*)
         """
     )
     count = response.get_next()[0]
     print(f"Merged {count} generic drug-brand relationships into the graph")
+    return count
 
 
-def merge_symptom_generic_drug_rel(df, conn) -> None:
-    # Merge symptom and generic drug relationships
-    symptom_drug_df = (
-        df.explode("side_effects")
-        .explode("drug")
-        .with_columns(
-            [
-                pl.col("side_effects").str.to_lowercase().alias("symptom"),
-                pl.col("drug")
-                .struct.field("generic_name")
-                .str.to_lowercase()
-                .alias("generic_name"),
-            ]
-        )
-    ).unique()
-
+@instrumented
+def merge_symptom_generic_drug_rel(symptom_drug_df: pl.DataFrame, conn: kuzu.Connection) -> int:
     response = conn.execute(
         """
         LOAD FROM symptom_drug_df
-        MATCH (d:DrugGeneric {name: generic_name}), (s:Symptom {name: symptom})
+        MATCH (d:DrugGeneric {id: generic_name_id})
+        MATCH (s:Symptom {id: symptom_id})
         MERGE (d)-[:CAN_CAUSE]->(s)
         RETURN COUNT(*)
         """
     )
     count = response.get_next()[0]
     print(f"Merged {count} symptom-generic drug relationships into the graph")
+    return count
+
+
+def read_drug_file(file: Path) -> pl.DataFrame:
+    if file.suffix == ".ndjson":
+        return pl.read_ndjson(file, schema=DRUG_SCHEMA)
+    return pl.read_json(file)
+
+
+@instrumented
+def read_drug_files(
+    files: list[Path], max_workers: int | None = None
+) -> list[dict[str, pl.DataFrame]]:
+    """
+    Parse and stage the input files concurrently, returning the staged frames in file order.
+
+    Polars releases the GIL while parsing and collecting, so a thread pool keeps every core
+    busy without pickling frames between processes.
+    """
+    # Each file is staged in a copy of this context, so its stages are recorded in the metrics
+    contexts = [copy_context() for _ in files]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(
+            pool.map(
+                lambda context, file: context.run(stage_drug_frames, read_drug_file(file)),
+                contexts,
+                files,
+            )
+        )
+
+
+def concat_drug_frames(staged: list[dict[str, pl.DataFrame]]) -> dict[str, pl.DataFrame]:
+    """
+    Combine the staged frames of several files and deduplicate them across files.
+    """
+    return {name: pl.concat([frames[name] for frames in staged]).unique() for name, _ in COPY_ORDER}
+
+
+def load_entity_dictionary(conn: kuzu.Connection) -> dict[str, pl.DataFrame]:
+    """
+    Read the id assigned to every name in each node table.
+
+    The graph itself is the persistent entity dictionary, so ids stay stable across runs.
+    """
+    return {
+        table: conn.execute(f"MATCH (n:{table}) RETURN n.id AS id, n.name AS name").get_as_pl()
+        for table in KEY_TABLES.values()
+    }
+
+
+def extend_entity_dictionary(
+    dictionary: dict[str, pl.DataFrame], frames: dict[str, pl.DataFrame]
+) -> dict[str, pl.DataFrame]:
+    """
+    Assign the next dense INT64 ids to node names that are not yet in the dictionary.
+    """
+    extended = dict(dictionary)
+    for name, column in NODE_KEYS.items():
+        table = KEY_TABLES[column]
+        known = dictionary[table]
+        unseen = (
+            frames[name]
+            .select(pl.col(column).alias("name"))
+            .drop_nulls()
+            .unique(maintain_order=True)
+            .join(known, on="name", how="anti")
+        )
+        next_id = known["id"].max() + 1 if len(known) else 0
+        assigned = unseen.with_row_index("id", offset=next_id).select(
+            pl.col("id").cast(pl.Int64), pl.col("name")
+        )
+        extended[table] = pl.concat([known, assigned])
+    return extended
+
 
+def encode_drug_frames(
+    frames: dict[str, pl.DataFrame], dictionary: dict[str, pl.DataFrame]
+) -> dict[str, pl.DataFrame]:
+    """
+    Replace names with their dictionary ids before writing to Kuzu.
+
+    Every name column `x` gains an `x_id` column. Node frames keep the name to store as a
+    property, relationship frames keep only the FROM and TO ids. Rows whose names have no
+    id are dropped, just as a MATCH on a missing node would drop them.
+    """
+    encoded = {}
+    for name, frame in frames.items():
+        ids = [f"{column}_id" for column in frame.columns]
+        result = frame
+        for column in frame.columns:
+            result = result.join(
+                dictionary[KEY_TABLES[column]].rename({"id": f"{column}_id", "name": column}),
+                on=column,
+                how="inner",
+            )
+        encoded[name] = result.select(ids + frame.columns if name in NODE_KEYS else ids)
+    return encoded
+
+
+def copy_drug_frames(frames: dict[str, pl.DataFrame], conn: kuzu.Connection) -> None:
+    """
+    Bulk load encoded frames into empty tables with COPY FROM via temporary Parquet files.
+
+    COPY FROM does not merge, so this is only valid for a fresh build where every frame
+    is already deduplicated and none of the target tables contain data yet.
+    """
+    with tempfile.TemporaryDirectory() as staging_dir:
+        for name, table in COPY_ORDER:
+            path = Path(staging_dir) / f"{name}.parquet"
+            with record_stage(f"copy_{name}", rows_in=len(frames[name]), conn=conn) as record:
+                frames[name].write_parquet(path)
+                conn.execute(f"COPY {table} FROM '{path.as_posix()}'")
+                record["rows_out"] = len(frames[name])
+            print(f"Copied {len(frames[name])} rows into {table}")
+
+
+# Staged frame -> MERGE function used to apply additions on incremental runs
+MERGE_FUNCTIONS = {
+    "conditions": merge_condition_nodes,
+    "symptoms": merge_symptom_nodes,
+    "generic_drugs": merge_generic_drug_nodes,
+    "brand_drugs": merge_brand_drug_nodes,
+    "condition_drug": merge_condition_generic_drug_rel,
+    "generic_drug_brand": merge_generic_drug_brand_rel,
+    "symptom_drug": merge_symptom_generic_drug_rel,
+}
+
+# Staged frame -> Cypher that removes the matching graph element on incremental runs
+DELETE_PATTERNS = {
+    "conditions": "MATCH (n:Condition {id: condition_id}) DETACH DELETE n",
+    "symptoms": "MATCH (n:Symptom {id: symptom_id}) DETACH DELETE n",
+    "generic_drugs": "MATCH (n:DrugGeneric {id: generic_name_id}) DETACH DELETE n",
+    "brand_drugs": "MATCH (n:DrugBrand {id: brand_name_id}) DETACH DELETE n",
+    "condition_drug": """
+        MATCH (:Condition {id: condition_id})
+              -[r:IS_TREATED_BY]->(:DrugGeneric {id: generic_name_id})
+        DELETE r
+    """,
+    "generic_drug_brand": """
+        MATCH (:DrugGeneric {id: generic_name_id})-[r:HAS_BRAND]->(:DrugBrand {id: brand_name_id})
+        DELETE r
+    """,
+    "symptom_drug": """
+        MATCH (:DrugGeneric {id: generic_name_id})-[r:CAN_CAUSE]->(:Symptom {id: symptom_id})
+        DELETE r
+    """,
+}
+
+
+@contextmanager
+def transaction(conn: kuzu.Connection):
+    """
+    Run the enclosed statements in one explicit Kuzu transaction, rolling back on error.
+    """
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def delete_drug_frame(name: str, dropped_df: pl.DataFrame, conn: kuzu.Connection) -> None:
+    with record_stage(f"delete_{name}", rows_in=len(dropped_df), conn=conn):
+        conn.execute(f"LOAD FROM dropped_df {DELETE_PATTERNS[name]}")
+    print(f"Deleted {len(dropped_df)} {name.replace('_', ' ')} rows from the graph")
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_dir: Path) -> tuple[dict[str, str], dict[str, pl.DataFrame]]:
+    """
+    Read the content hash of every ingested file and the frames each file contributed.
+
+    Contributions are stored as one Parquet file per staged frame, with a `source`
+    column naming the input file that produced each row.
+    """
+    hashes_path = manifest_dir / "files.json"
+    hashes = json.loads(hashes_path.read_text()) if hashes_path.exists() else {}
+    contributions = {}
+    for name, _ in COPY_ORDER:
+        path = manifest_dir / f"{name}.parquet"
+        if path.exists():
+            contributions[name] = pl.read_parquet(path)
+    return hashes, contributions
+
+
+def save_manifest(
+    manifest_dir: Path, hashes: dict[str, str], contributions: dict[str, pl.DataFrame]
+) -> None:
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+    for name, frame in contributions.items():
+        frame.write_parquet(manifest_dir / f"{name}.parquet")
+    (manifest_dir / "files.json").write_text(json.dumps(hashes, indent=4))
+
+
+def sync_drug_graph(
+    files: list[Path], conn: kuzu.Connection, manifest_dir: Path, fresh: bool = False
+) -> None:
+    """
+    Apply only the changes from input files whose content hash differs from the manifest.
+
+    Rows from changed or removed files are replaced by the newly staged rows, and the graph
+    receives the difference: rows no other file still contributes are deleted, and rows
+    that are new to the graph are merged (or bulk copied when `fresh` is set).
+    """
+    hashes, contributions = ({}, {}) if fresh else load_manifest(manifest_dir)
+    current_hashes = {file.name: file_digest(file) for file in files}
+    changed = [file for file in files if hashes.get(file.name) != current_hashes[file.name]]
+    touched = {file.name for file in changed} | (hashes.keys() - current_hashes.keys())
+    if not touched:
+        print("No drug files changed since the last run")
+        return
+    print(f"Ingesting {len(changed)} changed and {len(touched) - len(changed)} removed files")
+
+    staged = dict(zip([file.name for file in changed], read_drug_files(changed)))
+    added, dropped, updated = {}, {}, {}
+    for name, _ in COPY_ORDER:
+        previous = contributions.get(name)
+        frames = [
+            staged_frames[name].with_columns(pl.lit(source).alias("source"))
+            for source, staged_frames in staged.items()
+        ]
+        if previous is not None:
+            frames.insert(0, previous.filter(~pl.col("source").is_in(list(touched))))
+        updated[name] = pl.concat(frames)
+
+        keys = [column for column in updated[name].columns if column != "source"]
+        after = updated[name].select(keys).unique()
+        before = previous.select(keys).unique() if previous is not None else after.clear()
+        added[name] = after.join(before, on=keys, how="anti")
+        dropped[name] = before.join(after, on=keys, how="anti")
+
+    dictionary = extend_entity_dictionary(load_entity_dictionary(conn), added)
+    added = encode_drug_frames(added, dictionary)
+    dropped = encode_drug_frames(dropped, dictionary)
+    if fresh:
+        copy_drug_frames(added, conn)
+    else:
+        # Remove relationships before the nodes they reference, then merge the additions
+        with transaction(conn):
+            for name, _ in reversed(COPY_ORDER):
+                if len(dropped[name]):
+                    delete_drug_frame(name, dropped[name], conn)
+            for name, _ in COPY_ORDER:
+                if len(added[name]):
+                    MERGE_FUNCTIONS[name](added[name], conn)
+    save_manifest(manifest_dir, current_hashes, updated)
+
+
+def remove_database(db_path: str) -> None:
+    """
+    Remove a Kuzu database, which is a directory before Kuzu 0.9 and a single file after.
+    """
+    path = Path(db_path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+    Path(f"{db_path}.wal").unlink(missing_ok=True)
 
-def main(data_path: str, conn: kuzu.Connection) -> None:
+
+def main(
+    data_path: str, conn: kuzu.Connection, fresh: bool = False, manifest_dir: str | None = None
+) -> None:
     create_node_tables(conn)
     create_rel_tables(conn)
     # Ensure that the filenames of interest are prefixed with the term "drugs"
-    files = Path(data_path).glob("drugs*.json")
-    for file in files:
-        df = pl.read_json(file)
-        df_exploded = process_condition_column(df, "condition")
-        # Merge nodes
-        merge_condition_nodes(df_exploded, conn)
-        merge_symptom_nodes(df_exploded, conn)
-        merge_generic_drug_nodes(df_exploded, conn)
-        merge_brand_drug_nodes(df_exploded, conn)
-        # Merge relationships
-        merge_condition_generic_drug_rel(df_exploded, conn)
-        merge_generic_drug_brand_rel(df_exploded, conn)
-        merge_symptom_generic_drug_rel(df_exploded, conn)
+    files = sorted(
+        file for file in Path(data_path).glob("drugs*") if file.suffix in (".json", ".ndjson")
+    )
+    if manifest_dir is not None:
+        sync_drug_graph(files, conn, Path(manifest_dir), fresh=fresh)
+        return
+    if not files:
+        return
+    # Parse every file concurrently and deduplicate the staged frames across files
+    frames = concat_drug_frames(read_drug_files(files))
+    dictionary = extend_entity_dictionary(load_entity_dictionary(conn), frames)
+    frames = encode_drug_frames(frames, dictionary)
+    if fresh:
+        # The tables are empty, so the bulk loader can be used instead of MERGE
+        copy_drug_frames(frames, conn)
+        return
+    # Merge nodes before the relationships that match them, all in a single transaction
+    with transaction(conn):
+        for name, _ in COPY_ORDER:
+            MERGE_FUNCTIONS[name](frames[name], conn)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the drug side effects graph")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep the existing graph and only apply files that changed since the last run",
+    )
+    parser.add_argument(
+        "--metrics-report",
+        default=default_report_path("drug_graph"),
+        help="Where to write the per-stage timing report (.json or .csv)",
+    )
+    args = parser.parse_args()
+
     DB_NAME = "ex_kuzu_db"
-    shutil.rmtree(DB_NAME, ignore_errors=True)
+    MANIFEST_DIR = f"{DB_NAME}.manifest"
+    if not args.incremental:
+        remove_database(DB_NAME)
+        shutil.rmtree(MANIFEST_DIR, ignore_errors=True)
 
     db = kuzu.Database(DB_NAME)
-    conn = kuzu.Connection(db)
 
     data_path = "../data/extracted_data"
-    main(data_path, conn)
+    with IngestMetrics("drug_graph", args.metrics_report) as metrics:
+        conn = metrics.instrument(kuzu.Connection(db))
+        # Without --incremental the database was just removed, so the bulk COPY FROM path is used
+        main(data_path, conn, fresh=not args.incremental, manifest_dir=MANIFEST_DIR)
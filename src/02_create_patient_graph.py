@@ -1,16 +1,36 @@
 """
 This script is written to be run sequentially after 01_create_drug_graph.py
-Do not run this script before running 01_create_drug_graph.py
+Do not run this script before running 01_create_drug_graph.py; pipeline.py runs both in order
 """
 
+import argparse
+import io
+import itertools
+from pathlib import Path
+from typing import Iterator
+
 import kuzu
 import polars as pl
 
+from entity_resolution import EntityResolver
+from ingest_metrics import IngestMetrics, default_report_path, instrumented, record_stage
+
+NDJSON_SUFFIXES = {".ndjson", ".jsonl"}
+
+# Fixing the schema keeps every batch consistent, even when a batch has no value in a field
+NOTES_SCHEMA = pl.Schema(
+    {
+        "patient_id": pl.String,
+        "medication": pl.Struct(
+            {"name": pl.String, "date": pl.String, "dosage": pl.String, "frequency": pl.String}
+        ),
+        "side_effects": pl.List(pl.String),
+    }
+)
 
-def load_and_transform_data(file_path: str) -> pl.DataFrame:
-    """Load and transform patient data"""
-    df = pl.read_json(file_path)
 
+def transform_notes(df: pl.DataFrame) -> pl.DataFrame:
+    """Flatten the medication struct into the columns used by the merges"""
     df_mod = df.with_columns(
         pl.col("medication").struct.field("name").str.to_lowercase().alias("drug_name"),
         pl.col("medication").struct.field("date").str.to_date(format="%Y-%m-%d").alias("date"),
@@ -21,6 +41,34 @@ def load_and_transform_data(file_path: str) -> pl.DataFrame:
     return df_mod
 
 
+@instrumented
+def load_and_transform_data(file_path: str) -> pl.DataFrame:
+    """Load and transform patient data"""
+    return transform_notes(pl.read_json(file_path))
+
+
+@instrumented
+def parse_note_batch(lines: list[bytes]) -> pl.DataFrame:
+    return transform_notes(pl.read_ndjson(io.BytesIO(b"".join(lines)), schema=NOTES_SCHEMA))
+
+
+def iter_note_batches(file_path: str, batch_size: int) -> Iterator[pl.DataFrame]:
+    """
+    Yield the transformed patient notes `batch_size` patients at a time.
+
+    NDJSON files (.ndjson, .jsonl) are read line by line, so only one batch is held in
+    memory at a time. A JSON array has to be parsed whole, so only its merges are batched.
+    """
+    if Path(file_path).suffix not in NDJSON_SUFFIXES:
+        yield from load_and_transform_data(file_path).iter_slices(batch_size)
+        return
+    with open(file_path, "rb") as f:
+        while chunk := list(itertools.islice(f, batch_size)):
+            lines = [line for line in chunk if line.strip()]
+            if lines:
+                yield parse_note_batch(lines)
+
+
 def create_schema(conn: kuzu.Connection) -> None:
     """Create the patient schema in the database"""
     # Create the patient table
@@ -41,7 +89,46 @@ def create_schema(conn: kuzu.Connection) -> None:
     conn.execute("CREATE REL TABLE IF NOT EXISTS EXPERIENCES(FROM Patient TO Symptom)")
 
 
-def merge_patient_nodes(conn: kuzu.Connection, df: pl.DataFrame) -> None:
+def load_name_ids(conn: kuzu.Connection, table: str) -> pl.DataFrame:
+    """Read the id and name of every node in a drug graph table"""
+    return conn.execute(f"MATCH (n:{table}) RETURN n.id AS id, n.name AS name").get_as_pl()
+
+
+def load_brand_aliases(conn: kuzu.Connection) -> pl.DataFrame:
+    """Read every brand name as an alias of the id of its generic drug"""
+    return conn.execute(
+        "MATCH (g:DrugGeneric)-[:HAS_BRAND]->(b:DrugBrand) RETURN g.id AS id, b.name AS name"
+    ).get_as_pl()
+
+
+def build_resolvers(conn: kuzu.Connection) -> tuple[EntityResolver, EntityResolver]:
+    """Index the drug and symptom names of the graph once, for every batch of patients"""
+    drugs = EntityResolver(
+        load_name_ids(conn, "DrugGeneric"), load_brand_aliases(conn), alias_method="brand"
+    )
+    symptoms = EntityResolver(load_name_ids(conn, "Symptom"))
+    return drugs, symptoms
+
+
+def report_unresolved(resolvers: dict[str, EntityResolver], path: str | None = None) -> None:
+    """Print how many mentions did not resolve and optionally write them all to a CSV file"""
+    reports = []
+    for kind, resolver in resolvers.items():
+        unresolved = resolver.unresolved_report()
+        if len(unresolved) > 0:
+            examples = ", ".join(unresolved["mention"].head(5))
+            print(
+                f"Could not resolve {unresolved['count'].sum()} {kind} mentions "
+                f"({len(unresolved)} distinct, e.g. {examples})"
+            )
+        reports.append(unresolved.select(pl.lit(kind).alias("kind"), pl.all()))
+    if path is not None:
+        pl.concat(reports).write_csv(path)
+        print(f"Unresolved names written to {path}")
+
+
+@instrumented
+def merge_patient_nodes(conn: kuzu.Connection, df: pl.DataFrame) -> int:
     """Merge patient nodes and return count of merged nodes"""
     result = conn.execute(
         """
@@ -51,15 +138,19 @@ def merge_patient_nodes(conn: kuzu.Connection, df: pl.DataFrame) -> None:
         RETURN COUNT(p) AS num_patients
         """
     )
-    print(f"Merged {result.get_next()[0]} patient relationships")
+    count = result.get_next()[0]
+    print(f"Merged {count} patient relationships")
+    return count
 
 
-def merge_prescription_rels(conn: kuzu.Connection, df: pl.DataFrame) -> None:
+@instrumented
+def merge_prescription_rels(conn: kuzu.Connection, df: pl.DataFrame) -> int:
     """Merge prescription relationships and return count of merged relationships"""
     result = conn.execute(
         """
         LOAD FROM df
-        MATCH (p:Patient {patient_id: patient_id}), (d:DrugGeneric {name: drug_name})
+        MATCH (p:Patient {patient_id: patient_id})
+        MATCH (d:DrugGeneric {id: drug_name_id})
         MERGE (p)-[r:IS_PRESCRIBED]->(d)
            SET r.date = date,
                r.dosage = dosage,
@@ -67,40 +158,107 @@ def merge_prescription_rels(conn: kuzu.Connection, df: pl.DataFrame) -> None:
         RETURN COUNT(r) AS merged_count
         """
     )
-    print(f"Merged {result.get_next()[0]} prescription relationships")
+    count = result.get_next()[0]
+    print(f"Merged {count} prescription relationships")
+    return count
 
 
-def merge_symptom_rels(conn: kuzu.Connection, df: pl.DataFrame) -> None:
+@instrumented
+def merge_symptom_rels(conn: kuzu.Connection, df: pl.DataFrame) -> int:
     """Merge symptom relationships and return count of merged relationships"""
     result = conn.execute(
         """
         LOAD FROM df
-        WITH DISTINCT patient_id, side_effects
-        MATCH (p:Patient {patient_id: patient_id}), (s:Symptom {name: side_effects})
+        WITH DISTINCT patient_id, side_effects_id
+        MATCH (p:Patient {patient_id: patient_id})
+        MATCH (s:Symptom {id: side_effects_id})
         MERGE (p)-[r:EXPERIENCES]->(s)
         RETURN COUNT(r) AS merged_count
         """
     )
-    print(f"Merged {result.get_next()[0]} symptom relationships")
-
+    count = result.get_next()[0]
+    print(f"Merged {count} symptom relationships")
+    return count
 
-def main():
-    # Connect to the database
-    db = kuzu.Database("ex_kuzu_db")
-    conn = kuzu.Connection(db)
 
-    # Load and transform data
-    df = load_and_transform_data("../data/extracted_data/notes.json")
-    # Create schema
-    create_schema(conn)
+def merge_note_batch(
+    conn: kuzu.Connection,
+    df: pl.DataFrame,
+    drug_resolver: EntityResolver,
+    symptom_resolver: EntityResolver,
+) -> None:
+    """Merge one batch of patients together with their prescriptions and symptoms"""
+    symptoms = df.select("patient_id", "side_effects").explode("side_effects")
+    # Resolve every distinct drug and symptom mention of the batch to a node id at once
+    with record_stage("resolve_names", rows_in=len(df) + len(symptoms)):
+        drug_ids = drug_resolver.resolve(df["drug_name"]).select(
+            pl.col("mention").alias("drug_name"), pl.col("id").alias("drug_name_id")
+        )
+        symptom_ids = symptom_resolver.resolve(symptoms["side_effects"]).select(
+            pl.col("mention").alias("side_effects"), pl.col("id").alias("side_effects_id")
+        )
 
-    # Merge data and get counts
     merge_patient_nodes(conn, df.select("patient_id"))
     merge_prescription_rels(
-        conn, df.select("patient_id", "drug_name", "date", "dosage", "frequency")
+        conn,
+        df.join(drug_ids, on="drug_name").select(
+            "patient_id", "drug_name_id", "date", "dosage", "frequency"
+        ),
+    )
+    merge_symptom_rels(
+        conn,
+        symptoms.join(symptom_ids, on="side_effects").select("patient_id", "side_effects_id"),
     )
-    merge_symptom_rels(conn, df.select("patient_id", "side_effects").explode("side_effects"))
+
+
+def main(
+    db_path: str = "ex_kuzu_db",
+    notes_path: str = "../data/extracted_data/notes.json",
+    metrics_report: str | None = None,
+    batch_size: int = 10_000,
+    unresolved_report: str | None = None,
+):
+    with IngestMetrics("patient_graph", metrics_report) as metrics:
+        # Connect to the database
+        db = kuzu.Database(db_path)
+        conn = metrics.instrument(kuzu.Connection(db))
+
+        # Create schema
+        create_schema(conn)
+
+        # Index the drug names (with their brands) and symptom names of the drug graph once
+        with record_stage("build_resolvers", conn=conn):
+            drug_resolver, symptom_resolver = build_resolvers(conn)
+
+        # Load, transform and merge the patients one fixed-size batch at a time
+        for df in iter_note_batches(notes_path, batch_size):
+            merge_note_batch(conn, df, drug_resolver, symptom_resolver)
+
+        report_unresolved({"drug": drug_resolver, "symptom": symptom_resolver}, unresolved_report)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Add the patient notes to the drug graph")
+    parser.add_argument(
+        "--notes",
+        default="../data/extracted_data/notes.json",
+        help="Patient notes as a JSON array, or as NDJSON (.ndjson, .jsonl) to stream them",
+    )
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Patients per batch")
+    parser.add_argument(
+        "--unresolved-report",
+        help="Write the drug and symptom names that matched no node to this CSV file",
+    )
+    parser.add_argument(
+        "--metrics-report",
+        default=default_report_path("patient_graph"),
+        help="Where to write the per-stage timing report (.json or .csv)",
+    )
+    args = parser.parse_args()
+
+    main(
+        notes_path=args.notes,
+        metrics_report=args.metrics_report,
+        batch_size=args.batch_size,
+        unresolved_report=args.unresolved_report,
+    )
@@ -0,0 +1,62 @@
+"""
+Write the records of a streamed BAML extraction to NDJSON as soon as each one is complete.
+
+A BAML stream yields the list parsed so far after every chunk of LLM output. Once a list
+has grown past a record, the model has moved on to the next one, so that record is final
+and can be written while the rest of the response is still being generated. The NDJSON
+files can then be loaded as they grow, e.g. with `pl.scan_ndjson`.
+"""
+
+import json
+from pathlib import Path
+from typing import AsyncIterator, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+async def stream_records(stream, model: type[Model], skip: int = 0) -> AsyncIterator[Model]:
+    """
+    Yield every record of a `BamlStream` over a list of `model` as soon as it is complete,
+    after skipping the first `skip` records (those already written by an earlier attempt).
+    """
+    emitted = 0
+    async for partial in stream:
+        # Every record but the last one in a partial list is complete
+        while emitted < len(partial) - 1:
+            try:
+                record = model.model_validate(partial[emitted].model_dump())
+            except ValidationError:
+                # Leave a record that does not validate to the final, fully parsed response
+                break
+            if emitted >= skip:
+                yield record
+            emitted += 1
+    final = await stream.get_final_response()
+    for record in final[max(emitted, skip) :]:
+        yield record
+
+
+class NDJSONWriter:
+    """Append records to an NDJSON file, one JSON object per line, flushed as written."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.count = 0
+        self._file = path.open("w")
+
+    def write(self, record: BaseModel) -> None:
+        self._file.write(json.dumps(record.model_dump()) + "\n")
+        # Flush every record, so readers of the growing file see it right away
+        self._file.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "NDJSONWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
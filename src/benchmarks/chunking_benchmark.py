@@ -0,0 +1,132 @@
+"""
+Benchmark the structure-aware chunker of chunking.py against the previous 120-character slices.
+
+For each chunker, reports the number and size of the chunks, how many chunk boundaries cut a
+word in half and the chunking throughput, on the pages of a PDF (or a text file with pages
+separated by form feeds) repeated `--scale` times to stand in for a larger corpus. With
+`--retrieval`, the chunks of the unscaled document are also embedded with the model of
+embeddings.py, and each question below counts as answered when one of its top `--k`
+chunks contains all of its expected phrases (so the drug and its side effect must be in the
+same chunk). Run from this directory:
+uv run chunking_benchmark.py --scale 100 --retrieval
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from script_loader import load_script
+
+DEFAULT_PDF = Path(__file__).resolve().parents[2] / "data/pdf/Medication_Side_Effect_Flyer.pdf"
+
+# Questions about Medication_Side_Effect_Flyer.pdf and the phrases their answer needs
+QUESTIONS = [
+    ("What are the side effects of atorvastatin?", ["atorvastatin", "muscle pain"]),
+    ("Which medicines treat heartburn or reflux?", ["heartburn", "omeprazole"]),
+    ("What side effects does warfarin have?", ["warfarin", "bleeding"]),
+    ("What is ondansetron taken for?", ["ondansetron", "throwing up"]),
+    ("What are the side effects of metoprolol?", ["metoprolol", "lightheadedness"]),
+    ("Can lisinopril cause a cough?", ["lisinopril", "cough"]),
+    ("What are the side effects of morphine?", ["morphine", "constipation"]),
+    ("What is amiodarone prescribed for?", ["amiodarone", "heart rhythm"]),
+]
+
+
+def chunk_fixed(pages: list[str], size: int = 120) -> list[tuple[str, str, int]]:
+    """The previous chunking: slices of `size` characters of the concatenated pages."""
+    text = "".join(pages)
+    return [(text[i : i + size], text, i + size) for i in range(0, len(text), size)]
+
+
+def chunk_structured(chunking, max_tokens: int, overlap: int) -> Callable:
+    def chunk(pages: list[str]) -> list[tuple[str, str, int]]:
+        chunks = chunking.chunk_pages(pages, max_tokens, overlap)
+        return [(chunk.text, pages[chunk.page - 1], chunk.end) for chunk in chunks]
+
+    return chunk
+
+
+def words_cut(chunks: list[tuple[str, str, int]]) -> int:
+    """Chunks that end in the middle of a word of their source text"""
+    return sum(
+        0 < end < len(source) and source[end - 1].isalnum() and source[end].isalnum()
+        for _, source, end in chunks
+    )
+
+
+def measure(name: str, chunker: Callable, pages: list[str], count_tokens: Callable) -> None:
+    start = time.perf_counter()
+    chunks = chunker(pages)
+    seconds = time.perf_counter() - start
+    tokens = [count_tokens(text) for text, _, _ in chunks]
+    megabytes = sum(len(page) for page in pages) / 1e6
+    print(
+        f"{name:<11} {len(chunks):>8} chunks, {np.mean(tokens):6.1f} tokens on average "
+        f"(max {max(tokens)}), {words_cut(chunks):>6} cut words, "
+        f"{seconds:.3f}s ({megabytes / seconds:.1f} MB/s)"
+    )
+
+
+def recall_at_k(name: str, texts: list[str], embedder, k: int) -> None:
+    start = time.perf_counter()
+    embeddings = np.array(embedder.embed(texts))
+    embed_seconds = time.perf_counter() - start
+    questions = np.array(embedder.embed([q for q, _ in QUESTIONS]))
+    top_k = np.argsort(-(questions @ embeddings.T), axis=1)[:, :k]
+    answered = sum(
+        any(all(phrase in texts[i].lower() for phrase in phrases) for i in top)
+        for (_, phrases), top in zip(QUESTIONS, top_k)
+    )
+    print(
+        f"{name:<11} recall@{k} {answered}/{len(QUESTIONS)}, embedding {len(texts)} chunks "
+        f"took {embed_seconds:.2f}s, index of {embeddings.nbytes / 1024:.0f} KiB"
+    )
+
+
+def main(
+    pdf: Path | None, text: Path | None, scale: int, max_tokens: int, overlap: int, k: int
+) -> None:
+    chunking = load_script("chunking.py")
+    if text is not None:
+        pages = text.read_text().split("\f")
+    else:
+        pages = load_script("pdf_extractor.py").extract_pages(pdf or DEFAULT_PDF)
+    chunkers = {
+        "fixed": chunk_fixed,
+        "structured": chunk_structured(chunking, max_tokens, overlap),
+    }
+    print(f"{len(pages)} pages x {scale}, windows of {max_tokens} tokens, {overlap} overlap")
+    for name, chunker in chunkers.items():
+        measure(name, chunker, pages * scale, chunking.count_tokens)
+    if k:
+        # Only the retrieval benchmark needs the embedding model
+        embedder = load_script("embeddings.py").Embedder()
+        for name, chunker in chunkers.items():
+            recall_at_k(name, [chunk for chunk, _, _ in chunker(pages)], embedder, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", type=Path, default=None, help="PDF to chunk")
+    parser.add_argument(
+        "--text", type=Path, default=None, help="Text file to chunk instead, pages split by \\f"
+    )
+    parser.add_argument("--scale", type=int, default=1, help="Repeat the pages this many times")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Tokens per window")
+    parser.add_argument("--overlap", type=int, default=16, help="Tokens shared by windows")
+    parser.add_argument(
+        "--retrieval", action="store_true", help="Also measure retrieval with embeddings"
+    )
+    parser.add_argument("--k", type=int, default=2, help="Chunks retrieved per question")
+    args = parser.parse_args()
+    main(
+        args.pdf,
+        args.text,
+        args.scale,
+        args.max_tokens,
+        args.overlap,
+        args.k if args.retrieval else 0,
+    )
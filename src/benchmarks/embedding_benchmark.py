@@ -0,0 +1,60 @@
+"""
+Benchmark the throughput of embeddings.py over batch sizes and CPU threads.
+
+Chunks the pages of a PDF (or a text file with pages separated by form feeds) with
+pdf_extractor.py, repeats the chunks `--scale` times to stand in for a larger corpus, and
+reports the chunks embedded per second for each batch size and thread count, along with the
+seconds a call of one embedding (a query) takes. Run from this directory:
+uv run embedding_benchmark.py --scale 20 --batch-sizes 16 32 64 128 --threads 1 4
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from script_loader import load_script
+
+DEFAULT_PDF = Path(__file__).resolve().parents[2] / "data/pdf/Medication_Side_Effect_Flyer.pdf"
+
+
+def main(
+    pdf: Path | None, text: Path | None, scale: int, batch_sizes: list[int], threads: list[int]
+) -> None:
+    # Embed with the model of pdf_extractor.py instead of loading it a second time
+    extractor = load_script("pdf_extractor.py")
+    if text is not None:
+        pages = text.read_text().split("\f")
+    else:
+        pages = extractor.extract_pages(pdf or DEFAULT_PDF)
+    texts = [chunk.text for chunk in extractor.chunk_document(pages)] * scale
+    embedder = extractor.get_embedder()
+    # Warm up, the first batch is slower
+    embedder.embed(texts[:8])
+    print(f"{len(texts)} chunks")
+    for thread_count in threads:
+        extractor.set_threads(thread_count)
+        for batch_size in batch_sizes:
+            embedder.batch_size = batch_size
+            start = time.perf_counter()
+            embedder.embed(texts)
+            seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            embedder.embed([texts[0]])
+            query_seconds = time.perf_counter() - start
+            print(
+                f"{thread_count:>2} threads, batches of {batch_size:>4}: "
+                f"{len(texts) / seconds:8.1f} chunks/s, query {query_seconds * 1000:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", type=Path, default=None, help="PDF to chunk")
+    parser.add_argument(
+        "--text", type=Path, default=None, help="Text file to chunk instead, pages split by \\f"
+    )
+    parser.add_argument("--scale", type=int, default=10, help="Repeat the chunks this many times")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+    main(args.pdf, args.text, args.scale, args.batch_sizes, args.threads)
@@ -0,0 +1,192 @@
+"""
+Generate synthetic drug tables and patient notes shaped like the extracted data.
+
+Drug tables follow `ConditionAndDrug` and patient notes follow `PatientInfo`, so the
+output can be fed straight into 01_create_drug_graph.py and 02_create_patient_graph.py.
+Names are drawn with a Zipf-like popularity skew and list lengths are heavy tailed, so a
+few conditions have many drugs and a few rows have many side effects, as in real tables.
+Run from this directory: uv run generate_synthetic_data.py --rows 100000 --output-dir out
+"""
+
+import argparse
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+DOSAGES = ["2.5mg", "5mg", "10mg", "20mg", "30mg", "50mg", "100mg"]
+FREQUENCIES = ["daily", "twice daily", "three times daily", "weekly", "as needed"]
+CONDITION_SEPARATORS = [" or ", "/"]
+
+
+def zipf_choice(rng: np.random.Generator, size: int, vocab_size: int, exponent: float = 1.1):
+    """Draw vocabulary indices where index 0 is the most popular and popularity ~ 1/rank^s"""
+    weights = 1.0 / np.arange(1, vocab_size + 1) ** exponent
+    return rng.choice(vocab_size, size=size, p=weights / weights.sum())
+
+
+def skewed_lengths(
+    rng: np.random.Generator, size: int, median: float, sigma: float, maximum: int
+) -> np.ndarray:
+    """Log-normal list lengths of at least 1: mostly close to the median, with a long tail"""
+    lengths = rng.lognormal(np.log(median), sigma, size).astype(np.int64)
+    return np.clip(lengths, 1, maximum)
+
+
+def list_array(lengths: np.ndarray, values: pa.Array) -> pa.Array:
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return pa.LargeListArray.from_arrays(pa.array(offsets, pa.int64()), values)
+
+
+def vocabulary(prefix: str, size: int) -> pl.Series:
+    return pl.Series([f"{prefix}{i}" for i in range(size)])
+
+
+def generate_drug_table(rows: int, seed: int = 42) -> pl.DataFrame:
+    """
+    Build `rows` ConditionAndDrug records.
+
+    Vocabulary sizes grow with the number of rows, so larger tables also have more
+    distinct conditions, drugs, brands and symptoms, while popular names repeat across rows.
+    """
+    rng = np.random.default_rng(seed)
+    conditions = vocabulary("condition ", max(rows // 2, 10))
+    generics = vocabulary("drug", max(rows // 5, 50))
+    symptoms = vocabulary("symptom ", max(rows // 50, 30))
+
+    # About a fifth of the conditions combine two phrases, as in "Heartburn or Reflux"
+    condition = conditions.gather(zipf_choice(rng, rows, len(conditions)))
+    other = conditions.gather(zipf_choice(rng, rows, len(conditions)))
+    separator = pl.Series(CONDITION_SEPARATORS).gather(rng.integers(0, 2, rows))
+    combined = pl.Series(rng.random(rows) < 0.2)
+    condition = (
+        pl.DataFrame({"c": condition, "o": other, "s": separator, "combined": combined})
+        .select(
+            pl.when(pl.col("combined"))
+            .then(pl.col("c") + pl.col("s") + pl.col("o"))
+            .otherwise(pl.col("c"))
+            .str.to_titlecase()
+        )
+        .to_series()
+    )
+
+    drug_lengths = skewed_lengths(rng, rows, median=4, sigma=0.8, maximum=200)
+    generic_idx = zipf_choice(rng, int(drug_lengths.sum()), len(generics))
+    # Drugs without a brand carry a single empty string, like the extracted tables
+    brand_counts = rng.poisson(1.3, len(generic_idx))
+    brand_lengths = np.maximum(brand_counts, 1)
+    brand_generic = np.repeat(generic_idx, brand_lengths)
+    brand_number = rng.integers(0, 4, len(brand_generic))
+    has_brand = np.repeat(brand_counts > 0, brand_lengths)
+    brand_names = pl.DataFrame({"g": brand_generic, "n": brand_number, "b": has_brand}).select(
+        pl.when(pl.col("b"))
+        .then(pl.format("Brand{}x{}", pl.col("g"), pl.col("n")))
+        .otherwise(pl.lit(""))
+    )
+    drug = pa.StructArray.from_arrays(
+        [
+            generics.gather(generic_idx).to_arrow(),
+            list_array(brand_lengths, brand_names.to_series().to_arrow()),
+        ],
+        names=["generic_name", "brand_names"],
+    )
+
+    side_effect_lengths = skewed_lengths(rng, rows, median=4, sigma=0.6, maximum=60)
+    side_effects = symptoms.gather(zipf_choice(rng, int(side_effect_lengths.sum()), len(symptoms)))
+
+    table = pa.table(
+        {
+            "condition": condition.to_arrow(),
+            "drug": list_array(drug_lengths, drug),
+            "side_effects": list_array(side_effect_lengths, side_effects.to_arrow()),
+        }
+    )
+    return pl.from_arrow(table)
+
+
+def generate_patient_notes(patients: int, drug_rows: int, seed: int = 43) -> pl.DataFrame:
+    """
+    Build `patients` PatientInfo records whose drugs and symptoms come from the same
+    vocabularies as a drug table of `drug_rows` rows, so most of them resolve in the graph.
+    """
+    rng = np.random.default_rng(seed)
+    generics = vocabulary("drug", max(drug_rows // 5, 50))
+    symptoms = vocabulary("symptom ", max(drug_rows // 50, 30))
+
+    days = rng.integers(0, 365, patients)
+    start = date(2024, 1, 1)
+    side_effect_lengths = rng.integers(1, 5, patients)
+    side_effects = symptoms.gather(zipf_choice(rng, int(side_effect_lengths.sum()), len(symptoms)))
+    medication = pl.DataFrame(
+        {
+            "name": generics.gather(zipf_choice(rng, patients, len(generics))).str.to_titlecase(),
+            "date": pl.select(
+                (pl.lit(start) + pl.duration(days=pl.Series(days))).dt.to_string("%Y-%m-%d")
+            ).to_series(),
+            "dosage": pl.Series(DOSAGES).gather(rng.integers(0, len(DOSAGES), patients)),
+            "frequency": pl.Series(FREQUENCIES).gather(rng.integers(0, len(FREQUENCIES), patients)),
+        }
+    ).to_struct("medication")
+
+    table = pa.table(
+        {
+            "patient_id": pl.Series([f"P{i:08d}" for i in range(patients)]).to_arrow(),
+            "medication": medication.to_arrow(),
+            "side_effects": list_array(side_effect_lengths, side_effects.to_arrow()),
+        }
+    )
+    return pl.from_arrow(table)
+
+
+def write_dataset(
+    output_dir: Path,
+    rows: int,
+    patients: int,
+    files: int = 1,
+    seed: int = 42,
+    ndjson_notes: bool = False,
+) -> list[Path]:
+    """
+    Write the drug table split over `files` drugs_*.json files plus the patient notes, as
+    a notes.json array or, with `ndjson_notes`, as notes.ndjson with one patient per line.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    drugs = generate_drug_table(rows, seed)
+    paths = []
+    chunk = -(-rows // files)
+    for i in range(files):
+        path = output_dir / f"drugs_{i + 1}.json"
+        drugs.slice(i * chunk, chunk).write_json(path)
+        paths.append(path)
+    notes = generate_patient_notes(patients, rows, seed + 1)
+    notes_path = output_dir / ("notes.ndjson" if ndjson_notes else "notes.json")
+    if ndjson_notes:
+        notes.write_ndjson(notes_path)
+    else:
+        notes.write_json(notes_path)
+    paths.append(notes_path)
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000, help="Drug table rows")
+    parser.add_argument("--patients", type=int, help="Patient records (default: --rows)")
+    parser.add_argument("--files", type=int, default=1, help="Split the drug table over N files")
+    parser.add_argument("--output-dir", type=Path, default=Path("synthetic_data"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ndjson", action="store_true", help="Write the notes as NDJSON")
+    args = parser.parse_args()
+
+    patients = args.patients if args.patients is not None else args.rows
+    paths = write_dataset(
+        args.output_dir, args.rows, patients, args.files, args.seed, ndjson_notes=args.ndjson
+    )
+    for path in paths:
+        print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
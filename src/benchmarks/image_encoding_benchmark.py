@@ -0,0 +1,76 @@
+"""
+Benchmark loading large image files as base64 strings for BAML.
+
+Compares the previous path of image_extractor.py, which read each file into bytes and then
+encoded it, against the memory-mapped encode of image_encoding.py, cold and from its cache.
+Peak memory is the Python heap traced by tracemalloc while encoding a single file.
+Run from this directory: uv run image_encoding_benchmark.py --files 20 --size-mb 8
+"""
+
+import argparse
+import base64
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from script_loader import load_script
+
+
+def encode_file_read(path: Path) -> str:
+    """The previous implementation: read the whole file, then encode the copy."""
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    return base64.b64encode(image_bytes).decode()
+
+
+def make_scans(directory: Path, files: int, size_mb: float) -> list[Path]:
+    # Random bytes do not compress, like the pixel data of a PNG scan
+    paths = []
+    for i in range(files):
+        path = directory / f"scan_{i}.png"
+        path.write_bytes(os.urandom(int(size_mb * 1024 * 1024)))
+        paths.append(path)
+    return paths
+
+
+def run(name: str, encode: Callable[[Path], str], paths: list[Path], repeat: int) -> None:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            encode(path)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    encode(paths[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<12} best {min(timings):.3f}s for {len(paths)} files, "
+        f"peak {peak / (1024 * 1024):.1f} MiB per file"
+    )
+
+
+def main(files: int, size_mb: float, repeat: int) -> None:
+    image_encoding = load_script("image_encoding.py")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_scans(Path(directory), files, size_mb)
+        print(f"{files} files of {size_mb} MB, best of {repeat} runs")
+        run("read", encode_file_read, paths, repeat)
+        # Bypass the cache to time the memory-mapped encode itself
+        uncached = image_encoding._encode_file.__wrapped__
+        run("mmap", lambda path: uncached(path, path.stat().st_size, 0), paths, repeat)
+        # Fits the cache when there are no more files than its size, as on a retry
+        cached = paths[: image_encoding.ENCODED_CACHE_SIZE]
+        run("mmap cached", image_encoding.encode_file, cached, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20, help="Number of image files")
+    parser.add_argument("--size-mb", type=float, default=8, help="Size of each file in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each implementation")
+    args = parser.parse_args()
+    main(args.files, args.size_mb, args.repeat)
@@ -0,0 +1,117 @@
+"""
+End-to-end ingestion benchmark over synthetic datasets of increasing size.
+
+For every size, a drug table and patient notes are generated, then the drug graph and
+the patient graph are built into a fresh Kuzu database in a separate process, so each
+size starts from a clean heap and its peak RSS is its own. Throughput, per-stage timings
+and peak memory are printed and written to a JSON report for capacity planning.
+Run from this directory: uv run ingest_scale_benchmark.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from generate_synthetic_data import write_dataset
+from script_loader import load_script
+
+
+def run_ingest(data_dir: str, db_path: str, report_dir: str, fresh: bool, notes_path: str) -> None:
+    """Build both graphs from `data_dir`, writing one IngestMetrics report per script."""
+    import kuzu
+
+    drug_graph = load_script("01_create_drug_graph.py")
+    patient_graph = load_script("02_create_patient_graph.py")
+    from ingest_metrics import IngestMetrics
+
+    # The scripts report progress with print, which would drown the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = kuzu.Database(db_path)
+        with IngestMetrics("drug_graph", Path(report_dir) / "drug_graph.json") as metrics:
+            conn = metrics.instrument(kuzu.Connection(db))
+            drug_graph.main(data_dir, conn, fresh=fresh)
+        conn.close()
+        db.close()
+        patient_graph.main(db_path, notes_path, Path(report_dir) / "patient_graph.json")
+
+
+def benchmark_size(rows: int, files: int, fresh: bool, ndjson: bool, workdir: Path) -> dict:
+    data_dir = workdir / f"data_{rows}"
+    start = time.perf_counter()
+    notes_path = write_dataset(data_dir, rows, rows, files, ndjson_notes=ndjson)[-1]
+    generate_s = time.perf_counter() - start
+
+    report_dir = workdir / f"reports_{rows}"
+    # Spawn a fresh interpreter so the peak RSS of each size is measured on its own
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_ingest,
+        args=(str(data_dir), str(workdir / f"db_{rows}"), str(report_dir), fresh, str(notes_path)),
+    )
+    start = time.perf_counter()
+    process.start()
+    process.join()
+    ingest_s = time.perf_counter() - start
+    if process.exitcode != 0:
+        raise RuntimeError(f"Ingestion of {rows} rows failed with exit code {process.exitcode}")
+
+    drug = json.loads((report_dir / "drug_graph.json").read_text())
+    patient = json.loads((report_dir / "patient_graph.json").read_text())
+    return {
+        "rows": rows,
+        "patients": rows,
+        "files": files,
+        "mode": "copy" if fresh else "merge",
+        "generate_s": round(generate_s, 3),
+        "ingest_s": round(ingest_s, 3),
+        "drug_graph_s": drug["total_wall_s"],
+        "patient_graph_s": patient["total_wall_s"],
+        "drug_rows_per_s": round(rows / drug["total_wall_s"]),
+        "patient_rows_per_s": round(rows / patient["total_wall_s"]),
+        "peak_rss_mb": max(drug["peak_rss_mb"] or 0, patient["peak_rss_mb"] or 0),
+        "stages": drug["stages"] + patient["stages"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument(
+        "--rows-per-file", type=int, default=100_000, help="Split each drug table into files"
+    )
+    parser.add_argument(
+        "--merge", action="store_true", help="Use the MERGE path instead of COPY FROM"
+    )
+    parser.add_argument(
+        "--ndjson", action="store_true", help="Stream the patient notes from NDJSON"
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.sizes:
+            files = max(1, -(-rows // args.rows_per_file))
+            result = benchmark_size(rows, files, not args.merge, args.ndjson, Path(workdir))
+            results.append(result)
+            print(
+                f"{rows:>10,} rows ({result['mode']}): "
+                f"drug graph {result['drug_graph_s']:8.2f}s "
+                f"({result['drug_rows_per_s']:>9,} rows/s), "
+                f"patient graph {result['patient_graph_s']:8.2f}s "
+                f"({result['patient_rows_per_s']:>9,} rows/s), "
+                f"peak RSS {result['peak_rss_mb']:,.0f} MiB"
+            )
+
+    output = args.output or Path(f"ingest_scale_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output.write_text(json.dumps(results, indent=4))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
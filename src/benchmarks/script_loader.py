@@ -0,0 +1,19 @@
+"""
+Import the pipeline scripts in src/, whose file names are not valid module identifiers.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+
+def load_script(filename: str):
+    # The scripts import their sibling modules (e.g. ingest_metrics) from src/
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+    spec = importlib.util.spec_from_file_location(Path(filename).stem, SRC_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
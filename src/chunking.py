@@ -0,0 +1,157 @@
+"""
+Structure-aware chunking of document pages for embedding.
+
+Each page is split into units: markdown headings, and the sentences of the other lines (a
+line wrapped mid-sentence is joined to the next). Consecutive units of a section are packed
+into windows of at most `max_tokens` tokens, consecutive windows share up to
+`overlap_tokens` tokens of whole units, and a window never spans two sections or two pages.
+So no chunk cuts a word or a sentence in half unless the sentence alone is longer than a
+window. Every chunk is prefixed with the heading of its section and records the page and
+character offsets it was taken from.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+HEADING = re.compile(r"^#{1,6}\s+(.+?)\s*$")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=\S)")
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """Count words and punctuation marks, a lower bound of the tokens of subword tokenizers"""
+    return len(TOKEN.findall(text))
+
+
+@dataclass
+class Chunk:
+    text: str
+    page: int  # Numbered from 1
+    start: int  # Character offsets of the chunk in the text of its page
+    end: int
+    section: str | None
+    tokens: int
+
+    def metadata(self) -> dict:
+        # Chroma metadata values cannot be None
+        return {
+            "page": self.page,
+            "start": self.start,
+            "end": self.end,
+            "section": self.section or "",
+        }
+
+
+@dataclass
+class Unit:
+    start: int
+    end: int
+    heading: str | None = None
+
+
+def split_units(text: str) -> list[Unit | None]:
+    """The headings and sentences of a page in order, with None at paragraph breaks"""
+    units: list[Unit | None] = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        line_start = offset + len(line) - len(line.lstrip())
+        line_end = offset + len(line.rstrip())
+        offset += len(line)
+        if line_start >= line_end:
+            units.append(None)
+            continue
+        if heading := HEADING.match(text[line_start:line_end]):
+            units.append(Unit(line_start, line_end, heading.group(1)))
+            continue
+        start = line_start
+        previous = units[-1] if units else None
+        # A line starting in lowercase continues the sentence the previous line left open
+        if (
+            previous is not None
+            and previous.heading is None
+            and text[line_start].islower()
+            and text[previous.end - 1] not in ".!?:"
+        ):
+            start = units.pop().start
+        for match in SENTENCE_END.finditer(text, start, line_end):
+            units.append(Unit(start, match.start()))
+            start = match.end()
+        units.append(Unit(start, line_end))
+    return units
+
+
+def split_long_unit(
+    text: str, unit: Unit, max_tokens: int, count: Callable[[str], int]
+) -> list[Unit]:
+    """Cut a unit longer than a window into windows of whole words"""
+    pieces, start, end = [], None, None
+    for word in re.finditer(r"\S+", text[unit.start : unit.end]):
+        word_start, word_end = unit.start + word.start(), unit.start + word.end()
+        if start is not None and count(text[start:word_end]) > max_tokens:
+            pieces.append(Unit(start, end))
+            start = None
+        if start is None:
+            start = word_start
+        end = word_end
+    if start is not None:
+        pieces.append(Unit(start, end))
+    return pieces
+
+
+def chunk_pages(
+    pages: list[str],
+    max_tokens: int = 128,
+    overlap_tokens: int = 16,
+    count: Callable[[str], int] = count_tokens,
+) -> list[Chunk]:
+    """
+    Chunk the text of each page into windows of whole sentences within a section.
+
+    `count` counts the tokens of a text; pass the tokenizer of the embedding model to fit
+    its input length exactly.
+    """
+    chunks = []
+    section = None
+    for page_number, text in enumerate(pages, start=1):
+        window: list[tuple[Unit, int]] = []
+
+        def flush(keep_overlap: bool) -> None:
+            nonlocal window
+            if not window:
+                return
+            start, end = window[0][0].start, window[-1][0].end
+            body = text[start:end]
+            # Later windows of a section repeat its heading, so they can be retrieved by it
+            prefix = f"{section}\n" if section and not body.startswith("#") else ""
+            tokens = sum(tokens for _, tokens in window)
+            chunks.append(Chunk(prefix + body, page_number, start, end, section, tokens))
+            # Carry the last units that fit in the overlap over to the next window
+            kept, kept_tokens = [], 0
+            for unit, tokens in reversed(window[1:] if keep_overlap else []):
+                if kept_tokens + tokens > overlap_tokens:
+                    break
+                kept.insert(0, (unit, tokens))
+                kept_tokens += tokens
+            window = kept
+
+        for unit in split_units(text):
+            if unit is None:
+                continue
+            if unit.heading is not None:
+                flush(keep_overlap=False)
+                section = unit.heading
+            tokens = count(text[unit.start : unit.end])
+            pieces = (
+                split_long_unit(text, unit, max_tokens, count) if tokens > max_tokens else [unit]
+            )
+            for piece in pieces:
+                tokens = count(text[piece.start : piece.end]) if len(pieces) > 1 else tokens
+                if window and sum(t for _, t in window) + tokens > max_tokens:
+                    flush(keep_overlap=True)
+                    # Drop carried units until the new one fits
+                    while window and sum(t for _, t in window) + tokens > max_tokens:
+                        window.pop(0)
+                window.append((piece, tokens))
+        flush(keep_overlap=False)
+    return chunks
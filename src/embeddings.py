@@ -0,0 +1,83 @@
+"""
+Local sentence embeddings for the Chroma index and its queries.
+
+A single model embeds both the chunks when indexing and the questions when querying, so
+both are in the same space and Chroma never loads its own default embedding function.
+Texts are encoded in batches of `batch_size` (sentence-transformers sorts them by length
+first, so a batch pads little), on `threads` CPU threads when running on the CPU.
+
+Loading the model (and even importing torch) takes seconds, so nothing is loaded on import:
+`get_embedder` loads the shared model on first use, or `warm_up` loads it in the background.
+"""
+
+import threading
+from functools import wraps
+from typing import Callable, TypeVar
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+BATCH_SIZE = 64
+
+T = TypeVar("T")
+
+
+def lazy(load: Callable[[], T]) -> Callable[[], T]:
+    """An accessor that calls `load` on its first call only, even from several threads"""
+    lock = threading.Lock()
+    loaded: list[T] = []
+
+    @wraps(load)
+    def get() -> T:
+        if not loaded:
+            with lock:
+                # Another thread may have loaded it while this one waited for the lock
+                if not loaded:
+                    loaded.append(load())
+        return loaded[0]
+
+    return get
+
+
+def warm_up(*accessors: Callable) -> threading.Thread:
+    """Call lazy accessors in a background thread, so they are loaded before their first use"""
+    thread = threading.Thread(target=lambda: [get() for get in accessors], daemon=True)
+    thread.start()
+    return thread
+
+
+def set_threads(threads: int) -> None:
+    """Run the model on `threads` CPU threads (by default, one per core)"""
+    import torch
+
+    torch.set_num_threads(threads)
+
+
+class Embedder:
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        batch_size: int = BATCH_SIZE,
+        threads: int | None = None,
+        device: str | None = None,
+    ):
+        if threads:
+            set_threads(threads)
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """Normalized embeddings of `texts`, in order"""
+        embeddings = self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+        return embeddings.tolist()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.model.tokenizer.tokenize(text))
+
+
+@lazy
+def get_embedder() -> Embedder:
+    """The embedder shared by the index and its queries"""
+    return Embedder()
@@ -0,0 +1,177 @@
+"""
+Resolve the drug and symptom names mentioned in patient notes to nodes of the drug graph.
+
+An `EntityResolver` indexes the names of one node table, plus optional aliases such as the
+brand names of a generic drug, in memory. Mentions are then resolved a batch at a time with
+vectorized joins: first on the normalized name, then on an alias, and finally by fuzzy
+matching. Candidates for a fuzzy match are the names sharing a rare character trigram with
+the mention, and the ones with the highest trigram similarity are checked with the edit
+distance. Only the distinct mentions that were never seen before go through those steps;
+earlier results are cached, and unresolved mentions are counted so they can be reported.
+"""
+
+import polars as pl
+
+RESOLVED_SCHEMA = pl.Schema({"mention": pl.String, "id": pl.Int64, "method": pl.String})
+
+
+def normalize_names(expr: pl.Expr) -> pl.Expr:
+    return expr.str.to_lowercase().str.strip_chars().str.replace_all(r"\s+", " ")
+
+
+def trigrams(df: pl.DataFrame, column: str) -> pl.DataFrame:
+    """One row per distinct (name, trigram), with the names padded so short names have some"""
+    padded = pl.lit("  ") + pl.col(column) + pl.lit(" ")
+    return (
+        df.select(pl.col(column), padded.alias("padded"))
+        .with_columns(pl.int_ranges(0, pl.col("padded").str.len_chars() - 2).alias("offset"))
+        .explode("offset")
+        .select(pl.col(column), pl.col("padded").str.slice(pl.col("offset"), 3).alias("trigram"))
+        .unique()
+    )
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings"""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            )
+        previous = current
+    return previous[-1]
+
+
+class EntityResolver:
+    """Resolve mentions against the names and aliases of one node table."""
+
+    def __init__(
+        self,
+        names: pl.DataFrame,
+        aliases: pl.DataFrame | None = None,
+        alias_method: str = "alias",
+        min_similarity: float = 0.3,
+        max_edit_ratio: float = 0.25,
+        candidates: int = 3,
+        max_trigram_names: int = 200,
+    ):
+        """
+        `names` and `aliases` have an `id` and a `name` column. A fuzzy match is accepted when
+        its trigram similarity is at least `min_similarity` and its edit distance is at most
+        `max_edit_ratio` of the mention length (and at least 1). Trigrams found in more than
+        `max_trigram_names` names are too common to select candidates with, since joining on
+        them would pair a mention with a large part of the index.
+        """
+        index = [names.select("id", "name", pl.lit("exact").alias("method"))]
+        if aliases is not None:
+            index.append(aliases.select("id", "name", pl.lit(alias_method).alias("method")))
+        self.index = (
+            pl.concat(index)
+            .with_columns(normalize_names(pl.col("name")))
+            .unique(["id", "name"], keep="first", maintain_order=True)
+        )
+        self.index_trigrams = trigrams(self.index.select("name").unique(), "name")
+        self.trigram_counts = self.index_trigrams.group_by("name").agg(
+            pl.len().alias("name_trigrams")
+        )
+        self.rare_trigrams = (
+            self.index_trigrams.group_by("trigram")
+            .agg(pl.col("name"), pl.len().alias("names"))
+            .filter(pl.col("names") <= max_trigram_names)
+            .explode("name")
+            .select("trigram", "name")
+        )
+        self.min_similarity = min_similarity
+        self.max_edit_ratio = max_edit_ratio
+        self.candidates = candidates
+        self.resolved = pl.DataFrame(schema=RESOLVED_SCHEMA)
+        self.unresolved: dict[str, int] = {}
+
+    def resolve(self, mentions: pl.Series) -> pl.DataFrame:
+        """
+        Return a (mention, id, method) row for every distinct mention that resolves to a node.
+        A mention of an alias shared by several nodes resolves to all of them.
+        """
+        distinct = mentions.drop_nulls().unique().to_frame("mention")
+        new = distinct.join(self.resolved.select("mention").unique(), on="mention", how="anti")
+        new = new.filter(~pl.col("mention").is_in(list(self.unresolved)))
+        if len(new) > 0:
+            self.resolved = pl.concat([self.resolved, self._resolve_new(new)])
+
+        resolved = self.resolved.join(distinct, on="mention", how="semi")
+        missing = mentions.drop_nulls().to_frame("mention").join(resolved, on="mention", how="anti")
+        for mention, count in missing.group_by("mention").len().iter_rows():
+            self.unresolved[mention] = self.unresolved.get(mention, 0) + count
+        return resolved
+
+    def _resolve_new(self, new: pl.DataFrame) -> pl.DataFrame:
+        new = new.with_columns(normalize_names(pl.col("mention")).alias("name"))
+        matched = (
+            new.join(self.index, on="name")
+            # Prefer an exact name over an alias when a mention matches both
+            .sort(pl.col("method") != "exact")
+            .unique(["mention", "id"], keep="first", maintain_order=True)
+            .select("mention", "id", "method")
+        )
+        remaining = new.join(matched, on="mention", how="anti").filter(pl.col("name") != "")
+        if len(remaining) == 0:
+            return matched
+        return pl.concat([matched, self._fuzzy_match(remaining)])
+
+    def _fuzzy_match(self, remaining: pl.DataFrame) -> pl.DataFrame:
+        mention_trigrams = trigrams(remaining.select("name").unique(), "name").rename(
+            {"name": "mention_name"}
+        )
+        pairs = (
+            mention_trigrams.join(self.rare_trigrams, on="trigram")
+            .select("mention_name", "name")
+            .unique()
+        )
+        candidates = (
+            pairs.join(mention_trigrams, on="mention_name")
+            .join(self.index_trigrams, on=["name", "trigram"])
+            .group_by("mention_name", "name")
+            .agg(pl.len().alias("shared"))
+            .join(
+                mention_trigrams.group_by("mention_name").agg(pl.len().alias("mention_trigrams")),
+                on="mention_name",
+            )
+            .join(self.trigram_counts, on="name")
+            .with_columns(
+                (
+                    pl.col("shared")
+                    / (pl.col("mention_trigrams") + pl.col("name_trigrams") - pl.col("shared"))
+                ).alias("similarity")
+            )
+            .filter(pl.col("similarity") >= self.min_similarity)
+            .sort(["mention_name", "similarity", "name"], descending=[False, True, False])
+            .group_by("mention_name", maintain_order=True)
+            .head(self.candidates)
+        )
+        # Only the few best candidates per mention are checked with the edit distance
+        best = {}
+        for mention_name, name in candidates.select("mention_name", "name").iter_rows():
+            distance = edit_distance(mention_name, name)
+            if distance <= max(1, int(len(mention_name) * self.max_edit_ratio)):
+                if mention_name not in best or distance < best[mention_name][1]:
+                    best[mention_name] = (name, distance)
+        if not best:
+            return pl.DataFrame(schema=RESOLVED_SCHEMA)
+        matches = pl.DataFrame(
+            {"mention_name": list(best), "name": [name for name, _ in best.values()]}
+        )
+        return (
+            remaining.rename({"name": "mention_name"})
+            .join(matches, on="mention_name")
+            .join(self.index.select("id", "name").unique(), on="name")
+            .select("mention", "id", pl.lit("fuzzy").alias("method"))
+        )
+
+    def unresolved_report(self) -> pl.DataFrame:
+        """Every mention that did not resolve, with how often it occurred, most frequent first"""
+        return pl.DataFrame(
+            {"mention": list(self.unresolved), "count": list(self.unresolved.values())},
+            schema={"mention": pl.String, "count": pl.Int64},
+        ).sort(["count", "mention"], descending=[True, False])
@@ -0,0 +1,189 @@
+"""
+Checkpoint journal for batch extraction jobs, so a failed run can resume where it stopped.
+
+The journal is a JSON file with an entry per input: its status (pending, running, done or
+failed), the number of attempts, the last error and the output path, along with the hash of
+the input. It is rewritten after every change of status, so it survives a crash at any point.
+A resumed job only runs the inputs that are not done, or whose content or output changed
+since. The journal is also tied to the settings of the job; when they change, every input is
+run again.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+from pathlib import Path
+from typing import Any, Awaitable, Callable, TypeVar
+
+from baml_py.errors import BamlClientHttpError
+
+from rate_limit import RateLimitedClient
+
+T = TypeVar("T")
+
+# HTTP statuses of provider errors that are worth retrying: timeouts, rate limits and outages
+TRANSIENT_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an extraction failed on a provider or network error that may go away"""
+    if isinstance(error, BamlClientHttpError):
+        return error.status_code in TRANSIENT_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+
+async def retry_with_backoff(
+    call: Callable[[], Awaitable[T]],
+    retries: int = 3,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    on_retry: Callable[[int, Exception], None] | None = None,
+) -> T:
+    """
+    Await `call()`, retrying up to `retries` times after a transient error.
+
+    The n-th retry waits a random time up to `base_delay * 2**n` seconds (capped at
+    `max_delay`), so concurrent jobs hitting the same rate limit do not retry in lockstep.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            if on_retry:
+                on_retry(attempt + 1, e)
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2**attempt)))
+
+
+async def gather_or_cancel(*awaitables: Awaitable[T]) -> list[T]:
+    """
+    Await all `awaitables` concurrently like `asyncio.gather`, but as soon as one raises (or
+    this is cancelled), cancel the others and wait for them before raising its exception.
+
+    Unlike `asyncio.TaskGroup`, the exception is raised as is rather than in an
+    ExceptionGroup, so `is_transient` still recognizes it.
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def call_with_limits(
+    client,
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+    call: Callable[..., Awaitable[T]],
+    *args: Any,
+) -> T:
+    """
+    Await `call(client, *args)` while holding `semaphore`, cancelling it after `timeout` seconds.
+
+    With a RateLimitedClient, a provider is reserved for the call before the timeout starts,
+    so a wait for quota is not mistaken for a slow request and retried. The semaphore is only
+    held for the call itself, so it is not held while `retry_with_backoff` backs off.
+    """
+    async with semaphore:
+        if isinstance(client, RateLimitedClient):
+            client = await client.reserve(*args)
+        return await asyncio.wait_for(call(client, *args), timeout)
+
+
+def add_extraction_arguments(parser: argparse.ArgumentParser, inputs: str) -> None:
+    """The command line options shared by the extraction scripts, which send `inputs`"""
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Maximum number of requests in flight"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=120.0, help="Seconds to wait for each request"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help=f"Call the LLM even for {inputs} seen before"
+    )
+    parser.add_argument(
+        "--providers",
+        nargs="+",
+        default=None,
+        help="Rate limits as client:rpm:tpm to spread requests over (default: $LLM_PROVIDERS)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write token, cost and latency metrics of the LLM calls in Prometheus format",
+    )
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class JobJournal:
+    """Track the status of every input of a job in a JSON file."""
+
+    def __init__(self, path: str | Path, settings: dict, restart: bool = False):
+        self.path = Path(path)
+        self.settings = settings
+        journal = {}
+        if self.path.exists() and not restart:
+            journal = json.loads(self.path.read_text())
+        # Results produced with other settings are stale, so the job starts over
+        self.entries: dict[str, dict] = (
+            journal.get("inputs", {}) if journal.get("settings") == settings else {}
+        )
+
+    def pending(self, inputs: list[Path]) -> list[Path]:
+        """The inputs that still have to run, registering the new ones as pending"""
+        result = []
+        for path in inputs:
+            digest = file_hash(path)
+            entry = self.entries.get(str(path))
+            done = (
+                entry is not None
+                and entry["status"] == "done"
+                and entry["hash"] == digest
+                and Path(entry["output"]).exists()
+            )
+            if not done:
+                if entry is None or entry["hash"] != digest:
+                    entry = {"status": "pending", "attempts": 0, "error": None, "output": None}
+                self.entries[str(path)] = {**entry, "hash": digest}
+                result.append(path)
+        self.save()
+        return result
+
+    def start(self, path: Path) -> None:
+        entry = self.entries[str(path)]
+        entry["status"] = "running"
+        entry["attempts"] += 1
+        self.save()
+
+    def finish(self, path: Path, output: Path) -> None:
+        self.entries[str(path)].update(status="done", error=None, output=str(output))
+        self.save()
+
+    def fail(self, path: Path, error: Exception) -> None:
+        self.entries[str(path)].update(status="failed", error=repr(error))
+        self.save()
+
+    def counts(self) -> dict[str, int]:
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def save(self) -> None:
+        data = json.dumps({"settings": self.settings, "inputs": self.entries}, indent=4)
+        # Write to a temporary file first, so a crash never leaves a truncated journal
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
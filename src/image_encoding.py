@@ -0,0 +1,51 @@
+"""
+Load image files as the base64 strings BAML images are built from.
+
+A file is memory-mapped and base64-encoded straight from the mapping, so its bytes are never
+copied into a Python bytes object first, and the encoded string is decoded to `str` once.
+Recently encoded files are kept in a small cache keyed by path, size and modification time,
+so extracting the same scan again (e.g. on a retry) does not encode it again.
+"""
+
+import base64
+import mimetypes
+import mmap
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator
+
+# Encoded scans are a few MB each, so only a handful are kept
+ENCODED_CACHE_SIZE = 16
+
+
+def guess_mime_type(path: Path) -> str:
+    return mimetypes.guess_type(path)[0] or "image/png"
+
+
+def encode_image(data: bytes | memoryview | mmap.mmap) -> str:
+    """Base64-encode an image from any buffer, without copying it first"""
+    return base64.b64encode(data).decode("ascii")
+
+
+@contextmanager
+def mapped_file(path: Path) -> Iterator[bytes | mmap.mmap]:
+    """The contents of a file, memory-mapped rather than read into memory"""
+    with Path(path).open("rb") as f:
+        if f.seek(0, 2) == 0:  # An empty file cannot be memory-mapped
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+@lru_cache(maxsize=ENCODED_CACHE_SIZE)
+def _encode_file(path: Path, size: int, mtime_ns: int) -> str:
+    with mapped_file(path) as data:
+        return encode_image(data)
+
+
+def encode_file(path: Path) -> str:
+    """The base64 string of an image file, from the cache unless the file has changed"""
+    stat = path.stat()
+    return _encode_file(Path(path).resolve(), stat.st_size, stat.st_mtime_ns)
@@ -1,17 +1,47 @@
+import argparse
+import asyncio
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from functools import partial
 from pathlib import Path
+from typing import Awaitable, Callable
 
 # Updated imports using the src package
 from baml_py import Image
 from dotenv import load_dotenv
 
-from baml_client import b, reset_baml_env_vars, types
+from baml_client import b as sync_client
+from baml_client import reset_baml_env_vars, types
+from baml_client.async_client import b as async_client
+from baml_streaming import NDJSONWriter, stream_records
+from extraction_jobs import (
+    JobJournal,
+    add_extraction_arguments,
+    call_with_limits,
+    gather_or_cancel,
+    retry_with_backoff,
+)
+from image_encoding import encode_file, encode_image, guess_mime_type, mapped_file
+from image_preprocessing import (
+    PreprocessOptions,
+    pdf_page_count,
+    preprocess_image,
+    render_pdf_page,
+)
+from llm_cache import LLMCache, prompt_fingerprint
+from llm_metrics import METRICS, AccountedClient
+from rate_limit import RateLimitedClient, RateLimiter, rate_limiter
 
 load_dotenv()
 os.environ["BAML_LOG"] = "WARN"
 reset_baml_env_vars(dict(os.environ))
 
+b = AccountedClient(sync_client)
+async_b = AccountedClient(async_client)
+
 
 def extract_from_base64(
     base64_str: str, mime_type: str = "image/png"
@@ -22,19 +52,15 @@ def extract_from_base64(
     return result
 
 
-def extract_from_file(file_path: Path) -> list[types.ConditionAndDrug]:
-    """Extract entities from an image file"""
-    with open(file_path, "rb") as f:
-        image_bytes = f.read()
-    import base64
-
-    base64_str = base64.b64encode(image_bytes).decode()
+def image_from_file(file_path: Path) -> Image:
+    """Load an image file as a BAML image"""
     # Determine mime type based on file extension or use default
-    import mimetypes
+    return Image.from_base64(guess_mime_type(file_path), encode_file(file_path))
 
-    mime_type = mimetypes.guess_type(file_path)[0] or "image/png"
-    baml_image = Image.from_base64(mime_type, base64_str)
-    result = b.ExtractFromImage(baml_image)
+
+def extract_from_file(file_path: Path) -> list[types.ConditionAndDrug]:
+    """Extract entities from an image file"""
+    result = b.ExtractFromImage(image_from_file(file_path))
     return result
 
 
@@ -42,25 +68,319 @@ def extract_from_bytes(
     image_bytes: bytes, mime_type: str = "image/png"
 ) -> list[types.ConditionAndDrug]:
     """Extract entities from a bytes object"""
-    import base64
+    return extract_from_base64(encode_image(image_bytes), mime_type)
+
+
+def load_images(
+    file_path: Path, options: PreprocessOptions | None
+) -> list[tuple[bytes | Path, str]]:
+    """
+    The (image, mime type) of the images to send for a file: preprocessed PNG bytes if options
+    are set, otherwise the file itself, which is encoded by image_encoding.encode_file
+    """
+    if options is None:
+        return [(file_path, guess_mime_type(file_path))]
+    return [(png, "image/png") for png in preprocess_image(file_path, options)]
+
+
+def cache_key(cache: LLMCache, image: bytes | Path) -> str:
+    if isinstance(image, Path):
+        # Hashing the mapped file gives the same key as hashing its bytes, without reading them
+        with mapped_file(image) as data:
+            return cache.key("ExtractFromImage", data)
+    return cache.key("ExtractFromImage", image)
+
+
+def merge_rows(results: list[list[types.ConditionAndDrug]]) -> list[types.ConditionAndDrug]:
+    """
+    Merge the rows extracted from overlapping tiles of one table, in table order.
+
+    A row in the overlap of two tiles is extracted twice, and may be cut off in one of them,
+    so rows are matched on their condition and the one with the most drugs and side effects
+    is kept.
+    """
+    merged: dict[str, types.ConditionAndDrug] = {}
+    for row in (row for result in results for row in result):
+        key = " ".join(row.condition.lower().split())
+        size = len(row.drug) + len(row.side_effects)
+        if key not in merged or size > len(merged[key].drug) + len(merged[key].side_effects):
+            merged[key] = row
+    return list(merged.values())
+
+
+def output_name(file: Path, suffix: str) -> str:
+    # The drug graph only loads files named drugs*, so the results of a PDF get the prefix too
+    stem = file.stem if file.stem.startswith("drugs") else f"drugs_{file.stem}"
+    return stem + suffix
 
-    base64_str = base64.b64encode(image_bytes).decode()
-    baml_image = Image.from_base64(mime_type, base64_str)
-    result = b.ExtractFromImage(baml_image)
-    return result
+
+def write_result(result: list[types.ConditionAndDrug], output_path: Path) -> Path:
+    with output_path.open("w") as f:
+        json.dump([item.model_dump() for item in result], f, indent=4)
+    return output_path
+
+
+async def extract_files(
+    files: list[Path],
+    output_dir: Path,
+    concurrency: int = 8,
+    timeout: float = 120.0,
+    cache: LLMCache | None = None,
+    preprocess: PreprocessOptions | None = None,
+    stream: bool = False,
+    journal: JobJournal | None = None,
+    retries: int = 3,
+    limiter: RateLimiter | None = None,
+    render_workers: int | None = None,
+    pdf_tables: bool = False,
+) -> dict[Path, Exception]:
+    """
+    Extract entities from many image or PDF files concurrently with the async BAML client.
+
+    With `preprocess`, each image is cropped and downsampled first, and possibly cut into
+    tiles that are extracted concurrently and merged back into one table. At most
+    `concurrency` requests are in flight at once, and a request that takes longer than
+    `timeout` seconds is cancelled. Each result is written to `output_dir` as soon as it
+    arrives, or with `stream`, each row is appended to an NDJSON file as soon as it has
+    been parsed (the rows of a tiled image once its tiles are merged). When a tile or page
+    fails, the other requests of its file are cancelled. Images already in `cache` are not
+    sent at all. A file that fails on a transient provider error is retried up to `retries`
+    times with exponential backoff, and the status of every file is checkpointed in
+    `journal`. With a `limiter`, requests are spread across its providers within their rate
+    limits. A failed file does not stop the others; the failures are returned by file.
+
+    The pages of a PDF are rendered in a pool of `render_workers` processes, and each page
+    is extracted as soon as it has been rendered, with its rows in page order in the
+    result. At most `concurrency` pages of a file are rendered ahead of their extraction.
+    With `pdf_tables`, only the tables detected on each page are sent.
+    """
+    client = RateLimitedClient(async_b, limiter) if limiter else async_b
+    requests = asyncio.Semaphore(concurrency)
+    # Only a bounded number of files (and of pages of each) is loaded at a time, so a batch
+    # is not held in memory
+    files_in_progress = asyncio.Semaphore(concurrency)
+
+    async def request_image(
+        client, image: Image, writer: NDJSONWriter | None = None
+    ) -> list[types.ConditionAndDrug]:
+        if writer is None:
+            return await client.ExtractFromImage(image)
+        result = []
+        async for row in stream_records(
+            client.stream.ExtractFromImage(image), types.ConditionAndDrug
+        ):
+            writer.write(row)
+            result.append(row)
+        return result
+
+    async def extract_image(
+        source: bytes | Path, mime_type: str, writer: NDJSONWriter | None = None
+    ) -> list[types.ConditionAndDrug]:
+        key = cache_key(cache, source) if cache else None
+        result = cache.get(key, types.ConditionAndDrug) if cache else None
+        if result is None:
+            # A file is encoded from a memory map once, and taken from the cache on a retry
+            encoded = encode_file(source) if isinstance(source, Path) else encode_image(source)
+            image = Image.from_base64(mime_type, encoded)
+            call = partial(request_image, writer=writer)
+            result = await call_with_limits(client, requests, timeout, call, image)
+            if cache:
+                cache.put(key, result)
+        elif writer is not None:
+            for row in result:
+                writer.write(row)
+        return result
+
+    async def render_page(file: Path, page_number: int) -> list[list[tuple[bytes, str]]]:
+        pdf_options = preprocess or PreprocessOptions()
+        tables = await asyncio.get_running_loop().run_in_executor(
+            render_pool, render_pdf_page, file, page_number, pdf_options, pdf_tables
+        )
+        return [[(png, "image/png") for png in tiles] for tiles in tables]
+
+    async def extract_table(
+        tiles: list[tuple[bytes | Path, str]], writer: NDJSONWriter | None = None
+    ) -> list[types.ConditionAndDrug]:
+        if len(tiles) == 1:
+            return await extract_image(*tiles[0], writer)
+        # Rows of overlapping tiles are only written once they have been merged
+        results = await gather_or_cancel(*(extract_image(*tile) for tile in tiles))
+        rows = merge_rows(results)
+        if writer is not None:
+            for row in rows:
+                writer.write(row)
+        return rows
+
+    async def extract_page(
+        load: Callable[[], Awaitable[list[list[tuple[bytes | Path, str]]]]],
+        pages_in_progress: asyncio.Semaphore,
+        writer: NDJSONWriter | None = None,
+    ) -> list[types.ConditionAndDrug]:
+        # A page is only rendered once a slot is free, and keeps it until it is extracted,
+        # so the tiles of a long document do not pile up waiting for requests
+        async with pages_in_progress:
+            tables = await load()
+            # Only the tiles of one table are merged, so distinct tables sharing a condition
+            # on the same page keep their own rows
+            results = await gather_or_cancel(*(extract_table(tiles, writer) for tiles in tables))
+        return [row for table in results for row in table]
+
+    async def extract_file(file: Path) -> Path:
+        async with files_in_progress:
+            if file.suffix.lower() == ".pdf":
+                page_count = await asyncio.to_thread(pdf_page_count, file)
+                pages = [partial(render_page, file, number) for number in range(page_count)]
+            else:
+                # Preprocessing is CPU bound, so it runs in a thread while other requests wait;
+                # the tiles of an image file are those of a single table
+                pages = [partial(asyncio.to_thread, lambda: [load_images(file, preprocess)])]
+            pages_in_progress = asyncio.Semaphore(concurrency)
+            if stream:
+                output_path = output_dir / output_name(file, ".ndjson")
+                try:
+                    with NDJSONWriter(output_path) as writer:
+                        await gather_or_cancel(
+                            *(extract_page(page, pages_in_progress, writer) for page in pages)
+                        )
+                except Exception:
+                    output_path.unlink(missing_ok=True)
+                    raise
+            else:
+                results = await gather_or_cancel(
+                    *(extract_page(page, pages_in_progress) for page in pages)
+                )
+                result = [row for page in results for row in page]
+                output_path = write_result(result, output_dir / output_name(file, ".json"))
+        # Keep a single output per file, so the drug graph does not also load a stale one
+        stale_suffix = ".json" if stream else ".ndjson"
+        (output_dir / output_name(file, stale_suffix)).unlink(missing_ok=True)
+        return output_path
+
+    async def extract(file: Path) -> None:
+        def run() -> Awaitable[Path]:
+            if journal:
+                journal.start(file)
+            return extract_file(file)
+
+        def on_retry(attempt: int, error: Exception) -> None:
+            print(f"Retrying {file} ({attempt}/{retries}) after {error!r}")
+
+        try:
+            output_path = await retry_with_backoff(run, retries, on_retry=on_retry)
+        except Exception as e:
+            if journal:
+                journal.fail(file, e)
+            raise
+        if journal:
+            journal.finish(file, output_path)
+        print(f"Results written to {output_path}")
+
+    # Rendering is CPU bound, so PDF pages are rendered in other processes
+    has_pdfs = any(file.suffix.lower() == ".pdf" for file in files)
+    render_pool = ProcessPoolExecutor(render_workers) if has_pdfs else None
+    try:
+        outcomes = await asyncio.gather(*(extract(file) for file in files), return_exceptions=True)
+    finally:
+        if render_pool:
+            render_pool.shutdown(cancel_futures=True)
+    failures = {
+        file: outcome for file, outcome in zip(files, outcomes) if isinstance(outcome, Exception)
+    }
+    for file, error in failures.items():
+        reason = "timed out" if isinstance(error, asyncio.TimeoutError) else repr(error)
+        print(f"Failed to extract {file}: {reason}")
+    return failures
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract drug tables from images or PDFs")
+    parser.add_argument(
+        "--pdf", nargs="+", default=None, help="PDF files to extract instead of ../data/img"
+    )
+    parser.add_argument(
+        "--pdf-tables",
+        action="store_true",
+        help="Only send the tables detected on each PDF page, skipping pages without tables",
+    )
+    parser.add_argument(
+        "--render-workers", type=int, default=None, help="Processes rendering PDF pages"
+    )
+    add_extraction_arguments(parser, "images")
+    parser.add_argument(
+        "--retries", type=int, default=3, help="Retries of a file after a transient error"
+    )
+    parser.add_argument(
+        "--journal", default="image_jobs.json", help="Checkpoint journal of the extraction job"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Extract every image again instead of resuming from the journal",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each table row to an NDJSON file as soon as it has been parsed",
+    )
+    parser.add_argument(
+        "--no-preprocess", action="store_true", help="Send the images at full resolution"
+    )
+    parser.add_argument(
+        "--target-dpi", type=int, default=150, help="Resolution to downsample the images to"
+    )
+    parser.add_argument(
+        "--tile-height",
+        type=int,
+        default=0,
+        help="Cut tables taller than this many pixels into bands (0 disables tiling)",
+    )
+    args = parser.parse_args()
+
     input_dir = Path("../data/img")
     output_dir = Path("../data/extracted_data")
     output_dir.mkdir(parents=True, exist_ok=True)
-    files = list(input_dir.glob("drugs_*.png"))
-    for file in files:
-        # We are working with files, so we can pass in the file path directly
-        result = extract_from_file(file)
-        output_path = output_dir / file.with_suffix(".json").name
-
-        with output_path.open("w") as f:
-            json.dump([item.model_dump() for item in result], f, indent=4)
-
-        print(f"Results written to {output_path}")
+    files = [Path(pdf) for pdf in args.pdf] if args.pdf else sorted(input_dir.glob("drugs_*.png"))
+    cache = None if args.no_cache else LLMCache()
+    preprocess = (
+        None
+        if args.no_preprocess
+        else PreprocessOptions(target_dpi=args.target_dpi, tile_height=args.tile_height)
+    )
+    # Results depend on the prompt and the way images are sent, so both are tied to the journal
+    settings = {
+        "prompt": prompt_fingerprint("ExtractFromImage"),
+        "preprocess": asdict(preprocess) if preprocess else None,
+        "stream": args.stream,
+        "pdf_tables": args.pdf_tables,
+    }
+    journal = JobJournal(args.journal, settings, restart=args.restart)
+    pending = journal.pending(files)
+    if len(pending) < len(files):
+        print(f"Resuming: {len(files) - len(pending)} of {len(files)} images already extracted")
+    limiter = rate_limiter(args.providers)
+    failures = asyncio.run(
+        extract_files(
+            pending,
+            output_dir,
+            args.concurrency,
+            args.timeout,
+            cache=cache,
+            preprocess=preprocess,
+            stream=args.stream,
+            journal=journal,
+            retries=args.retries,
+            limiter=limiter,
+            render_workers=args.render_workers,
+            pdf_tables=args.pdf_tables,
+        )
+    )
+    if cache:
+        print(cache.report())
+    if limiter:
+        print(limiter.report())
+    print(METRICS.summary())
+    if args.metrics_file:
+        METRICS.write(args.metrics_file)
+    print(f"Journal {args.journal}: {journal.counts()}")
+    if failures:
+        sys.exit(1)
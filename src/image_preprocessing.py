@@ -0,0 +1,131 @@
+"""
+Shrink table images before they are sent to a vision model.
+
+The image is rendered once with PyMuPDF at the target resolution, the white margins around
+the content are cropped, and a tall table can be cut into horizontal bands. Every band
+repeats the table header at its top and overlaps the previous band by a few rows' worth of
+pixels, so a row cut at a band boundary is still whole in one of the bands. Smaller images
+mean fewer vision tokens and faster responses.
+
+Pages of a PDF are rendered the same way, straight from the PDF at the target resolution,
+either whole or as the table regions PyMuPDF detects on them. The functions only take
+picklable arguments, so pages can be rendered in a process pool.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import fitz
+import numpy as np
+
+
+@dataclass
+class PreprocessOptions:
+    # Resolution the images were scanned at, and the resolution to send them at
+    source_dpi: int = 200
+    target_dpi: int = 150
+    # Pixels whose darkest channel is above this value count as background
+    background_threshold: int = 245
+    margin: int = 8
+    # Bands are only cut when tile_height is set; all heights are in output pixels
+    tile_height: int = 0
+    header_height: int = 100
+    tile_overlap: int = 60
+
+
+def render(path: Path, options: PreprocessOptions) -> np.ndarray:
+    """Render an image file as an RGB array, downsampled to the target resolution"""
+    with fitz.open(path) as doc:
+        page = doc[0]
+        # Pixels of the source image per point of the page PyMuPDF wraps it in, read from the
+        # image's metadata instead of decoding it a second time
+        images = page.get_image_info()
+        pixels_per_point = images[0]["width"] / page.rect.width if images else 1.0
+        scale = min(1.0, options.target_dpi / options.source_dpi)
+        zoom = pixels_per_point * scale
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+    return pixmap_array(pix)
+
+
+def pixmap_array(pix: fitz.Pixmap) -> np.ndarray:
+    rows = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return rows[:, : pix.width * 3].reshape(pix.height, pix.width, 3)
+
+
+def crop_background(image: np.ndarray, threshold: int = 245, margin: int = 8) -> np.ndarray:
+    """Crop the rows and columns around the content that only hold background pixels"""
+    content = image.min(axis=2) < threshold
+    rows = np.flatnonzero(content.any(axis=1))
+    cols = np.flatnonzero(content.any(axis=0))
+    if len(rows) == 0:
+        return image
+    top, bottom = max(rows[0] - margin, 0), min(rows[-1] + margin + 1, image.shape[0])
+    left, right = max(cols[0] - margin, 0), min(cols[-1] + margin + 1, image.shape[1])
+    return image[top:bottom, left:right]
+
+
+def tile_rows(
+    image: np.ndarray, tile_height: int, header_height: int, overlap: int
+) -> list[np.ndarray]:
+    """Cut an image into bands of about `tile_height` rows, each starting with the header"""
+    height = image.shape[0]
+    if tile_height <= 0 or height <= tile_height:
+        return [image]
+    header = image[:header_height]
+    # The header is repeated on every band, so the band itself only has the rest of the space
+    band_height = max(tile_height - header_height, overlap + 1)
+    tiles = [image[:tile_height]]
+    end = tile_height
+    while end < height:
+        start = end - overlap
+        end = start + band_height
+        tiles.append(np.vstack([header, image[start:end]]))
+    return tiles
+
+
+def to_png(image: np.ndarray) -> bytes:
+    height, width, _ = image.shape
+    pix = fitz.Pixmap(fitz.csRGB, width, height, np.ascontiguousarray(image).tobytes(), False)
+    return pix.tobytes("png")
+
+
+def crop_and_tile(image: np.ndarray, options: PreprocessOptions) -> list[bytes]:
+    """Return the PNG bytes of the cropped image, or of its bands if tiled"""
+    image = crop_background(image, options.background_threshold, options.margin)
+    tiles = tile_rows(image, options.tile_height, options.header_height, options.tile_overlap)
+    return [to_png(tile) for tile in tiles]
+
+
+def preprocess_image(path: Path, options: PreprocessOptions | None = None) -> list[bytes]:
+    """Return the PNG bytes of the cropped, downsampled image, or of its bands if tiled"""
+    options = options or PreprocessOptions()
+    return crop_and_tile(render(path, options), options)
+
+
+def pdf_page_count(path: Path) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def render_pdf_page(
+    path: Path, page_number: int, options: PreprocessOptions, tables_only: bool = False
+) -> list[list[bytes]]:
+    """
+    Render a PDF page at the target resolution as PNG bytes, cropped and possibly tiled, with
+    the tiles of each table in a list of their own. With `tables_only`, each table PyMuPDF
+    detects on the page is rendered on its own, and a page without tables renders to nothing;
+    otherwise the whole page is a single table.
+    """
+    zoom = options.target_dpi / 72  # PDF coordinates are in points of 1/72 inch
+    with fitz.open(path) as doc:
+        page = doc[page_number]
+        clips = [fitz.Rect(t.bbox) for t in page.find_tables().tables] if tables_only else [None]
+        images = [
+            pixmap_array(
+                page.get_pixmap(
+                    matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csRGB, alpha=False
+                )
+            )
+            for clip in clips
+        ]
+    return [crop_and_tile(image, options) for image in images]
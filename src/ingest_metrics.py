@@ -0,0 +1,170 @@
+"""
+Per-stage instrumentation for the graph ingestion scripts.
+
+Decorate a stage function with `@instrumented` (or wrap a block in `record_stage`) and
+run the ingestion inside an `IngestMetrics` context. Each stage then records its wall
+time, rows in and out, the Kuzu compile + execution time spent in it, and the process
+peak RSS, and the context writes all records to a JSON or CSV report when it exits.
+Stages may be nested (a stage can call another), so the total wall time of a JSON report
+is that of the whole run, measured by the context, not the sum of its stages.
+Outside an `IngestMetrics` context the instrumentation does nothing.
+"""
+
+import csv
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+import kuzu
+import polars as pl
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+REPORT_FIELDS = ["run", "stage", "rows_in", "rows_out", "wall_s", "kuzu_s", "peak_rss_mb"]
+
+_ACTIVE_METRICS: ContextVar["IngestMetrics | None"] = ContextVar("active_metrics", default=None)
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process so far, in MiB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KiB on Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+class InstrumentedConnection:
+    """Wrap a kuzu.Connection and accumulate the time Kuzu spends compiling and executing."""
+
+    def __init__(self, conn: kuzu.Connection):
+        self._conn = conn
+        self.kuzu_ms = 0.0
+
+    def execute(self, query, parameters=None):
+        # Kuzu resolves `LOAD FROM df` by walking up the caller frames, so the extra
+        # frame added by this wrapper does not hide the caller's dataframes
+        result = self._conn.execute(query, parameters)
+        for r in result if isinstance(result, list) else [result]:
+            self.kuzu_ms += r.get_compiling_time() + r.get_execution_time()
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class IngestMetrics:
+    """Collect stage records for one ingestion run and write them to a report on exit."""
+
+    def __init__(self, run: str, report_path: str | Path | None = None):
+        self.run = run
+        self.started_at = datetime.now()
+        self.report_path = Path(report_path) if report_path else None
+        self.stages: list[dict] = []
+        self._start: float | None = None
+        self.wall_s: float | None = None
+
+    def elapsed_s(self) -> float | None:
+        """Wall time of the run: up to its exit, or so far while it is running"""
+        if self.wall_s is not None or self._start is None:
+            return self.wall_s
+        return round(time.perf_counter() - self._start, 6)
+
+    def instrument(self, conn: kuzu.Connection) -> InstrumentedConnection:
+        return conn if isinstance(conn, InstrumentedConnection) else InstrumentedConnection(conn)
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None, conn=None):
+        """Record one stage; the caller may set `rows_out` on the yielded record."""
+        record = {"run": self.run, "stage": name, "rows_in": rows_in, "rows_out": None}
+        kuzu_ms = conn.kuzu_ms if isinstance(conn, InstrumentedConnection) else None
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = round(time.perf_counter() - start, 6)
+            record["kuzu_s"] = (
+                round((conn.kuzu_ms - kuzu_ms) / 1000, 6) if kuzu_ms is not None else None
+            )
+            record["peak_rss_mb"] = peak_rss_mb()
+            self.stages.append(record)
+
+    def write_report(self, path: str | Path) -> Path:
+        """Write the stage records as CSV if the path ends in .csv, otherwise as JSON"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".csv":
+            with path.open("w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.stages)
+        else:
+            report = {
+                "run": self.run,
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "total_wall_s": self.elapsed_s(),
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": self.stages,
+            }
+            path.write_text(json.dumps(report, indent=4))
+        return path
+
+    def __enter__(self) -> "IngestMetrics":
+        self._token = _ACTIVE_METRICS.set(self)
+        self._start = time.perf_counter()
+        self.wall_s = None
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.wall_s = self.elapsed_s()
+        _ACTIVE_METRICS.reset(self._token)
+        if self.report_path is not None:
+            print(f"Ingestion metrics written to {self.write_report(self.report_path)}")
+
+
+def default_report_path(run: str, directory: str = "ingest_reports") -> Path:
+    return Path(directory) / f"{run}_{datetime.now():%Y%m%d_%H%M%S}.json"
+
+
+@contextmanager
+def record_stage(name: str, rows_in: int | None = None, conn=None):
+    """Record a stage in the active IngestMetrics, or do nothing if none is active."""
+    metrics = _ACTIVE_METRICS.get()
+    if metrics is None:
+        yield {}
+        return
+    with metrics.stage(name, rows_in=rows_in, conn=conn) as record:
+        yield record
+
+
+def instrumented(fn):
+    """
+    Record every call of a stage function in the active IngestMetrics, if there is one.
+
+    Rows in is the length of the first DataFrame argument. Rows out is the return value
+    when the stage returns a count, or its length when it returns a DataFrame.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        values = [*args, *kwargs.values()]
+        frame = next((v for v in values if isinstance(v, pl.DataFrame)), None)
+        conn = next((v for v in values if isinstance(v, InstrumentedConnection)), None)
+        rows_in = len(frame) if frame is not None else None
+        with record_stage(fn.__name__, rows_in=rows_in, conn=conn) as record:
+            result = fn(*args, **kwargs)
+            if isinstance(result, pl.DataFrame):
+                record["rows_out"] = len(result)
+            elif isinstance(result, int):
+                record["rows_out"] = result
+        return result
+
+    return wrapper
@@ -0,0 +1,138 @@
+"""
+Persistent, content-addressed cache for the results of BAML extraction functions.
+
+A result is stored under the hash of the function name, its input bytes and the BAML source
+that produces it: the file defining the function and the LLM client it calls, taken from
+baml_client/inlinedbaml.py. Editing a prompt or its client therefore only invalidates the
+entries of the functions it affects. Entries are JSON files; when the cache grows past its
+size limit, the least recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import tempfile
+from functools import cache
+from pathlib import Path
+from typing import TypeVar
+
+from pydantic import BaseModel
+
+from baml_client.inlinedbaml import get_baml_files
+
+CACHE_DIR = Path("llm_cache")
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+def client_block(source: str, client: str) -> str:
+    """The `client<llm> name { ... }` block of `client` in a BAML source, if present"""
+    match = re.search(rf"client<llm>\s+{re.escape(client)}\s*\{{", source)
+    if match is None:
+        return ""
+    depth = 0
+    for end in range(match.end() - 1, len(source)):
+        depth += {"{": 1, "}": -1}.get(source[end], 0)
+        if depth == 0:
+            return source[match.start() : end + 1]
+    return source[match.start() :]
+
+
+@cache
+def prompt_fingerprint(function: str) -> str:
+    """Hash the BAML file defining `function` and the definition of the client it calls"""
+    files = sorted(get_baml_files().items())
+    definition = re.compile(rf"function\s+{re.escape(function)}\s*\(")
+    for path, source in files:
+        if match := definition.search(source):
+            break
+    else:
+        raise ValueError(f"BAML function {function} is not defined in baml_src")
+    client = re.search(r"\bclient\s+(\w+)", source[match.end() :])
+    client_source = "".join(client_block(s, client.group(1)) for _, s in files) if client else ""
+    return hashlib.sha256(f"{path}\n{source}\n{client_source}".encode()).hexdigest()
+
+
+class LLMCache:
+    """Cache the list of models a BAML function returns for a given input."""
+
+    def __init__(self, directory: str | Path = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = sum(path.stat().st_size for path in self.directory.glob("*.json"))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, function: str, payload: bytes | mmap.mmap) -> str:
+        """The cache key of calling `function` on `payload` with its current BAML source"""
+        digest = hashlib.sha256()
+        for part in (function.encode(), prompt_fingerprint(function).encode(), payload):
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def get(self, key: str, model: type[Model]) -> list[Model] | None:
+        """The cached result stored under `key` as a list of `model`, or None on a miss"""
+        path = self.directory / f"{key}.json"
+        try:
+            items = json.loads(path.read_text())
+            # Entries are evicted by modification time, so a hit marks the entry as recently used
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [model.model_validate(item) for item in items]
+
+    def put(self, key: str, result: list[BaseModel]) -> None:
+        data = json.dumps([item.model_dump() for item in result]).encode()
+        path = self.directory / f"{key}.json"
+        try:
+            # An entry written again replaces the existing one, whose size no longer counts
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        # Write to a temporary file first, so concurrent readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.size += len(data) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in its size limit"""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # Evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size_bytes": self.size,
+        }
+
+    def report(self) -> str:
+        return (
+            f"LLM cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+            f"{self.size / (1024 * 1024):.1f} MiB in {self.directory}"
+        )
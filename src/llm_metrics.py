@@ -0,0 +1,399 @@
+"""
+Token, cost and latency accounting of BAML function calls.
+
+Wrap a generated BAML client in `AccountedClient` and every call (streamed or not) gets its
+own `Collector`. Once the call is done, its log is aggregated by function and by the client
+that served it: input and output tokens, cost, total latency, time to the first streamed
+token, LLM calls retried by the client's retry policy or fallbacks, and failed calls. The
+aggregates are exported in the Prometheus text format, either served over HTTP for scraping
+or written to a file for the node exporter's textfile collector.
+"""
+
+import inspect
+import os
+import re
+import threading
+from collections import deque
+from functools import cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from baml_py import Collector
+
+from baml_client.inlinedbaml import get_baml_files
+from llm_cache import client_block
+
+LABELS = ("function", "client")
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+# USD per million input and output tokens of the models in baml_src/clients.baml
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "claude-3.5-sonnet": (3.00, 15.00),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+
+
+@cache
+def client_model(client: str) -> str | None:
+    """The model a BAML client calls, without its provider prefix (e.g. `openai/`)"""
+    for source in get_baml_files().values():
+        if match := re.search(r'\bmodel\s+"([^"]+)"', client_block(source, client)):
+            return match.group(1).split("/")[-1]
+    return None
+
+
+def call_cost(client: str, input_tokens: int, output_tokens: int) -> float:
+    """The cost of a call in USD, or 0 for a model without a known price"""
+    input_price, output_price = PRICES.get(client_model(client), (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def format_labels(labels: tuple, **extra) -> str:
+    pairs = [*zip(LABELS, labels), *extra.items()]
+    return ",".join(f'{name}="{value}"' for name, value in pairs)
+
+
+class Histogram:
+    """A Prometheus histogram with one series per (function, client)."""
+
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # Per series: the count of observations in each bucket, their sum and their count
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def mean(self, labels: tuple) -> float | None:
+        series = self.series.get(labels)
+        return series[1] / series[2] if series else None
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{{{format_labels(labels, le=bound)}}} {bucket_count}"
+                )
+            lines.append(f"{self.name}_bucket{{{format_labels(labels, le='+Inf')}}} {count}")
+            lines.append(f"{self.name}_sum{{{format_labels(labels)}}} {total}")
+            lines.append(f"{self.name}_count{{{format_labels(labels)}}} {count}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter with one series per (function, client)."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{format_labels(labels)}}} {value}")
+        return lines
+
+
+class LLMMetrics:
+    """Aggregate the logs of BAML function calls by function and client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Records queued by finalizers, which must not take the lock: the garbage collector
+        # may run them on a thread that already holds it
+        self._queued: deque[tuple[str, Collector, bool]] = deque()
+        self.latency = Histogram(
+            "llm_request_duration_seconds", "Latency of BAML function calls", LATENCY_BUCKETS
+        )
+        self.time_to_first_token = Histogram(
+            "llm_time_to_first_token_seconds",
+            "Time to the first token of streamed BAML function calls",
+            LATENCY_BUCKETS,
+        )
+        self.input_tokens = Histogram(
+            "llm_input_tokens", "Input tokens of BAML function calls", TOKEN_BUCKETS
+        )
+        self.output_tokens = Histogram(
+            "llm_output_tokens", "Output tokens of BAML function calls", TOKEN_BUCKETS
+        )
+        self.requests = Counter("llm_requests_total", "BAML function calls")
+        self.retries = Counter(
+            "llm_retries_total", "LLM calls retried by a retry policy or fallback client"
+        )
+        self.errors = Counter("llm_errors_total", "BAML function calls that failed")
+        self.cost = Counter("llm_cost_usd_total", "Cost of BAML function calls in USD")
+
+    def record_later(self, function: str, collector: Collector, failed: bool = False) -> None:
+        """Queue a record, to be made before the next record or export"""
+        self._queued.append((function, collector, failed))
+
+    def _record_queued(self) -> None:
+        while self._queued:
+            try:
+                self._record(*self._queued.popleft())
+            except IndexError:  # Taken by another thread
+                break
+
+    def record(self, function: str, collector: Collector, failed: bool = False) -> None:
+        self._record_queued()
+        self._record(function, collector, failed)
+
+    def _record(self, function: str, collector: Collector, failed: bool) -> None:
+        log = collector.last
+        calls = log.calls if log else []
+        # The call whose response was used, or the last one tried if none was
+        call = next((call for call in calls if call.selected), calls[-1] if calls else None)
+        labels = (function, call.client_name if call else "unknown")
+        with self._lock:
+            self.requests.inc(labels)
+            self.retries.inc(labels, max(len(calls) - 1, 0))
+            if failed:
+                self.errors.inc(labels)
+            if log is None:
+                return
+            if log.timing.duration_ms is not None:
+                self.latency.observe(labels, log.timing.duration_ms / 1000)
+            first_token_ms = getattr(call.timing, "time_to_first_token_ms", None) if call else None
+            if first_token_ms is not None:
+                self.time_to_first_token.observe(labels, first_token_ms / 1000)
+            usage = log.usage
+            if usage and usage.input_tokens is not None and usage.output_tokens is not None:
+                self.input_tokens.observe(labels, usage.input_tokens)
+                self.output_tokens.observe(labels, usage.output_tokens)
+                self.cost.inc(labels, call_cost(labels[1], usage.input_tokens, usage.output_tokens))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        metrics = [
+            self.latency,
+            self.time_to_first_token,
+            self.input_tokens,
+            self.output_tokens,
+            self.requests,
+            self.retries,
+            self.errors,
+            self.cost,
+        ]
+        self._record_queued()
+        with self._lock:
+            return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def write(self, path: str | Path) -> None:
+        # Write to a temporary file first, so a scraper never reads a partial file
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(self.render())
+        os.replace(tmp, path)
+
+    def summary(self) -> str:
+        lines = ["LLM calls by function and client:"]
+        self._record_queued()
+        with self._lock:
+            for labels, requests in sorted(self.requests.series.items()):
+                latency = self.latency.mean(labels)
+                input_tokens = self.input_tokens.mean(labels)
+                output_tokens = self.output_tokens.mean(labels)
+                lines.append(
+                    f"  {labels[0]} ({labels[1]}): {requests:.0f} calls, "
+                    f"{self.errors.series.get(labels, 0):.0f} failed, "
+                    f"{self.retries.series.get(labels, 0):.0f} retries, "
+                    + (f"mean {latency:.2f}s, " if latency is not None else "")
+                    + (
+                        f"mean {input_tokens:.0f} in / {output_tokens:.0f} out tokens, "
+                        if input_tokens is not None
+                        else ""
+                    )
+                    + f"${self.cost.series.get(labels, 0):.4f}"
+                )
+        return "\n".join(lines)
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """Serve the metrics at http://localhost:<port>/metrics from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.end_headers()
+                if self.path == "/metrics":
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Metrics of every accounted client in this process
+METRICS = LLMMetrics()
+
+
+class AccountedClient:
+    """
+    Wrap a generated `BamlSyncClient` or `BamlAsyncClient`, so that every call of a BAML
+    function (and of its `.stream` functions) is recorded in `metrics`, the module's shared
+    METRICS by default.
+    """
+
+    def __init__(self, client, metrics: LLMMetrics = METRICS):
+        self.client = client
+        self.metrics = metrics
+
+    @property
+    def stream(self) -> "AccountedStreamClient":
+        return AccountedStreamClient(self.client.stream, self.metrics)
+
+    def __getattr__(self, function: str):
+        call = getattr(self.client, function)
+        metrics = self.metrics
+        if inspect.iscoroutinefunction(call):
+
+            async def accounted_call(*args, baml_options: dict | None = None):
+                collector = Collector(name=function)
+                try:
+                    result = await call(*args, baml_options=collected(collector, baml_options))
+                except BaseException:
+                    # Including a call cancelled by a timeout, so slow calls are counted too
+                    metrics.record(function, collector, failed=True)
+                    raise
+                metrics.record(function, collector)
+                return result
+
+        else:
+
+            def accounted_call(*args, baml_options: dict | None = None):
+                collector = Collector(name=function)
+                try:
+                    result = call(*args, baml_options=collected(collector, baml_options))
+                except BaseException:
+                    metrics.record(function, collector, failed=True)
+                    raise
+                metrics.record(function, collector)
+                return result
+
+        return accounted_call
+
+
+def collected(collector: Collector, baml_options: dict | None) -> dict:
+    """The `baml_options` of a call, with `collector` added to any collectors already set"""
+    options = dict(baml_options or {})
+    existing = options.get("collector", [])
+    options["collector"] = [*(existing if isinstance(existing, list) else [existing]), collector]
+    return options
+
+
+class AccountedStreamClient:
+    """The `.stream` functions of an accounted client"""
+
+    def __init__(self, stream_client, metrics: LLMMetrics):
+        self.stream_client = stream_client
+        self.metrics = metrics
+
+    def __getattr__(self, function: str):
+        stream = getattr(self.stream_client, function)
+
+        def accounted_stream(*args, baml_options: dict | None = None) -> AccountedStream:
+            collector = Collector(name=function)
+            return AccountedStream(
+                stream(*args, baml_options=collected(collector, baml_options)),
+                self.metrics,
+                function,
+                collector,
+            )
+
+        return accounted_stream
+
+
+class AccountedStream:
+    """
+    A BAML stream that records its call once: with its final response, or as soon as its
+    iteration fails, is cancelled or is abandoned, or when it is dropped without either.
+    """
+
+    def __init__(self, stream, metrics: LLMMetrics, function: str, collector: Collector):
+        self.stream = stream
+        self.metrics = metrics
+        self.function = function
+        self.collector = collector
+        self.recorded = False
+
+    def record(self, failed: bool) -> None:
+        if not self.recorded:
+            self.recorded = True
+            self.metrics.record(self.function, self.collector, failed)
+
+    async def __aiter__(self):
+        completed = failed = False
+        try:
+            async for partial in self.stream:
+                yield partial
+            completed = True
+        except GeneratorExit:
+            # The caller stopped iterating early, which is not a failure of the call
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # A completed stream is recorded with its final response, which has its full usage
+            if not completed:
+                self.record(failed)
+
+    def __iter__(self):
+        completed = failed = False
+        try:
+            yield from self.stream
+            completed = True
+        except GeneratorExit:
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            if not completed:
+                self.record(failed)
+
+    def __del__(self):
+        # A stream whose final response is never retrieved is still counted, once the
+        # garbage collector drops it, which may happen while this thread holds the lock
+        if not self.recorded:
+            self.recorded = True
+            self.metrics.record_later(self.function, self.collector)
+
+    async def _await_final_response(self, final):
+        try:
+            result = await final
+        except BaseException:
+            self.record(True)
+            raise
+        self.record(False)
+        return result
+
+    def get_final_response(self):
+        try:
+            result = self.stream.get_final_response()
+        except BaseException:
+            self.record(True)
+            raise
+        # The final response of an async stream is awaited by the caller
+        if inspect.isawaitable(result):
+            return self._await_final_response(result)
+        self.record(False)
+        return result
@@ -1,26 +1,189 @@
+import argparse
+import asyncio
 import json
 import os
+import re
+import sys
+from functools import partial
 from pathlib import Path
+from typing import Awaitable
 
 from dotenv import load_dotenv
 
 # Import directly from src package
-from baml_client import b, reset_baml_env_vars, types
+from baml_client import b as sync_client
+from baml_client import reset_baml_env_vars, types
+from baml_client.async_client import b as async_client
+from baml_streaming import NDJSONWriter, stream_records
+from extraction_jobs import add_extraction_arguments, call_with_limits, retry_with_backoff
+from llm_cache import LLMCache
+from llm_metrics import METRICS, AccountedClient
+from rate_limit import RateLimitedClient, RateLimiter, estimate_tokens, rate_limiter
 
 load_dotenv()
 os.environ["BAML_LOG"] = "WARN"
 reset_baml_env_vars(dict(os.environ))
 
+b = AccountedClient(sync_client)
+async_b = AccountedClient(async_client)
 
-def extract_notes(notes: str) -> list[types.PatientInfo]:
-    return b.ExtractMedicationInfo(notes)
+# Every patient record starts with a "Patient ID:" header line
+RECORD_HEADER = re.compile(r"^(?=Patient ID:)", re.MULTILINE)
+
+
+def extract_notes(notes: str, cache: LLMCache | None = None) -> list[types.PatientInfo]:
+    if cache is None:
+        return b.ExtractMedicationInfo(notes)
+    key = cache.key("ExtractMedicationInfo", notes.encode())
+    result = cache.get(key, types.PatientInfo)
+    if result is None:
+        result = b.ExtractMedicationInfo(notes)
+        cache.put(key, result)
+    return result
+
+
+def split_notes(notes: str) -> list[str]:
+    """Split a note dump into one record per `Patient ID:` header"""
+    return [record.strip() for record in RECORD_HEADER.split(notes) if record.strip()]
+
+
+def batch_records(records: list[str], max_tokens: int = 2000) -> list[str]:
+    """
+    Group consecutive records into batches of at most `max_tokens` estimated tokens.
+    A record larger than the budget is sent in a batch of its own.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for record in records:
+        tokens = estimate_tokens(record)
+        if batch and batch_tokens + tokens > max_tokens:
+            batches.append("\n\n".join(batch))
+            batch, batch_tokens = [], 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        batches.append("\n\n".join(batch))
+    return batches
+
+
+async def extract_batches(
+    batches: list[str],
+    concurrency: int = 8,
+    timeout: float = 120.0,
+    retries: int = 2,
+    cache: LLMCache | None = None,
+    writer: NDJSONWriter | None = None,
+    limiter: RateLimiter | None = None,
+) -> list[list[types.PatientInfo] | Exception]:
+    """
+    Extract every batch concurrently, with at most `concurrency` requests in flight.
+
+    A batch that fails on a transient provider error or takes longer than `timeout` seconds
+    is retried on its own, up to `retries` more times with exponential backoff. Results are
+    returned in the order of the batches, with the last error in place of the result of a
+    batch that never succeeded. With a `writer`, the responses are streamed and every patient
+    is written as soon as it has been parsed, in the order the batches produce them. With a
+    `limiter`, requests are spread across its providers within their rate limits.
+    """
+    client = RateLimitedClient(async_b, limiter) if limiter else async_b
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request_batch(
+        client, batch: str, written: list[types.PatientInfo]
+    ) -> list[types.PatientInfo]:
+        if writer is None:
+            return await client.ExtractMedicationInfo(batch)
+        # A retry skips the patients that a failed attempt already wrote
+        stream = client.stream.ExtractMedicationInfo(batch)
+        async for patient in stream_records(stream, types.PatientInfo, skip=len(written)):
+            writer.write(patient)
+            written.append(patient)
+        return written
+
+    async def extract(batch: str) -> list[types.PatientInfo]:
+        key = cache.key("ExtractMedicationInfo", batch.encode()) if cache else None
+        result = cache.get(key, types.PatientInfo) if cache else None
+        if result is not None:
+            for patient in result if writer else []:
+                writer.write(patient)
+            return result
+        written = []
+
+        def run() -> Awaitable[list[types.PatientInfo]]:
+            call = partial(request_batch, written=written)
+            return call_with_limits(client, semaphore, timeout, call, batch)
+
+        def on_retry(attempt: int, error: Exception) -> None:
+            records = len(split_notes(batch))
+            print(f"Retrying a batch of {records} records ({attempt}/{retries}) after {error!r}")
+
+        result = await retry_with_backoff(run, retries, on_retry=on_retry)
+        if cache:
+            cache.put(key, result)
+        return result
+
+    return await asyncio.gather(*(extract(batch) for batch in batches), return_exceptions=True)
 
 
 if __name__ == "__main__":
-    notes = Path("../data/text/notes_1.txt").read_text()
-    # Model dump the result into a json file
-    result = extract_notes(notes)
+    parser = argparse.ArgumentParser(description="Extract medication info from nurse's notes")
+    parser.add_argument(
+        "--notes",
+        nargs="+",
+        default=None,
+        help="Note dumps to read (default: every ../data/text/notes_*.txt)",
+    )
+    parser.add_argument(
+        "--max-tokens", type=int, default=2000, help="Estimated input tokens per batch"
+    )
+    add_extraction_arguments(parser, "notes")
+    parser.add_argument("--retries", type=int, default=2, help="Retries of a failed batch")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each patient to notes.ndjson as soon as it has been parsed",
+    )
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else LLMCache()
+    # Every note dump is read by default, matching the inputs of the pipeline's extract_notes
+    notes = args.notes or sorted(Path("../data/text").glob("notes_*.txt"))
+    records = [record for path in notes for record in split_notes(Path(path).read_text())]
+    batches = batch_records(records, args.max_tokens)
+    print(f"Extracting {len(records)} patient records in {len(batches)} batches")
     output_path = Path("../data/extracted_data")
     output_path.mkdir(parents=True, exist_ok=True)
-    with open(output_path / "notes.json", "w") as f:
-        json.dump([item.model_dump() for item in result], f, indent=4)
+    ndjson_path = output_path / "notes.ndjson"
+    writer = NDJSONWriter(ndjson_path) if args.stream else None
+    limiter = rate_limiter(args.providers)
+    try:
+        outcomes = asyncio.run(
+            extract_batches(
+                batches, args.concurrency, args.timeout, args.retries, cache, writer, limiter
+            )
+        )
+    finally:
+        if writer:
+            writer.close()
+    if cache:
+        print(cache.report())
+    if limiter:
+        print(limiter.report())
+    print(METRICS.summary())
+    if args.metrics_file:
+        METRICS.write(args.metrics_file)
+    failed = [i for i, outcome in enumerate(outcomes) if isinstance(outcome, Exception)]
+    if failed:
+        # No notes are left behind, so the graph is never built from partial notes; the
+        # batches that did succeed are cached, so running again only sends the failed ones
+        for i in failed:
+            print(f"Failed to extract batch {i + 1}/{len(batches)}: {outcomes[i]!r}")
+        if writer:
+            ndjson_path.unlink(missing_ok=True)
+        sys.exit(1)
+    if writer:
+        print(f"Results written to {ndjson_path}")
+    else:
+        # Merge the batch results in the order of the notes, and model dump them into a json file
+        result = [item for outcome in outcomes for item in outcome]
+        with open(output_path / "notes.json", "w") as f:
+            json.dump([item.model_dump() for item in result], f, indent=4)
@@ -1,30 +1,69 @@
+import argparse
 from pathlib import Path
 from typing import List
-from sentence_transformers import SentenceTransformer
 import fitz
-import chromadb
-from chromadb.config import Settings
 
+from chunking import Chunk, chunk_pages
+from embeddings import BATCH_SIZE, get_embedder, lazy, set_threads, warm_up
 
-CHUNK_SIZE=120
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
 
-CHROMA_DIR = './chroma_db'
+# Windows in tokens of the embedding model, which truncates its input at 256 tokens
+MAX_CHUNK_TOKENS = 128
+CHUNK_OVERLAP_TOKENS = 16
 
-CHROMA = chromadb.PersistentClient(path=CHROMA_DIR)
+CHROMA_DIR = './chroma_db'
 
 COLLECTION_NAME = 'drug_interactions'
 
-COLLECTION = CHROMA.get_or_create_collection(name=COLLECTION_NAME)
 
+# The Chroma client and the embedding model load on first use, not when this module is imported
+@lazy
+def get_chroma():
+    import chromadb
+
+    return chromadb.PersistentClient(path=CHROMA_DIR)
+
+
+@lazy
+def get_collection():
+    # The embeddings of embeddings.py are passed explicitly, Chroma embeds nothing itself
+    return get_chroma().get_or_create_collection(name=COLLECTION_NAME, embedding_function=None)
+
+
+def warm_up_index():
+    """Load the embedding model and open the collection in a background thread"""
+    return warm_up(get_embedder, get_collection)
+
+
+def page_markdown(page: fitz.Page) -> str:
+    """
+    The text of a page, one line per line of the PDF and a blank line after each block,
+    with the bold lines marked as markdown headings (but not bold labels such as "Examples:")
+    """
+    lines = []
+    for block in page.get_text('dict')['blocks']:
+        for line in block.get('lines', []):
+            spans = [span for span in line['spans'] if span['text'].strip()]
+            text = ''.join(span['text'] for span in spans).strip()
+            if not text:
+                continue
+            bold = all(span['flags'] & fitz.TEXT_FONT_BOLD for span in spans)
+            if bold and not text.endswith(':') and len(text) <= 80:
+                text = f'# {text}'
+            lines.append(text)
+        lines.append('')
+    return '\n'.join(lines)
 
-def create_markdown(filename: Path) -> Path:
-    doc = fitz.open(filename)
 
-    text = ""
+def extract_pages(filename: Path) -> List[str]:
+    with fitz.open(filename) as doc:
+        return [page_markdown(page) for page in doc]
 
-    for page in doc:
-        text += page.get_text()
+
+def create_markdown(filename: Path, pages: List[str] | None = None) -> Path:
+    pages = extract_pages(filename) if pages is None else pages
+
+    text = '\n'.join(pages)
 
     output_dir = Path('../data/extracted_data')
 
@@ -38,32 +77,65 @@ def create_markdown(filename: Path) -> Path:
     return output_path
 
 
-def chunk_text(text: str, chunk_size=CHUNK_SIZE) -> List[str]:
-    return [
-        text[i:i+chunk_size] for i in range(0, len(text), chunk_size)
-    ]
+def count_model_tokens(text: str) -> int:
+    return get_embedder().count_tokens(text)
+
+
+def chunk_document(pages: List[str]) -> List[Chunk]:
+    """Chunk the pages into windows of whole sentences within a section, see chunking.py"""
+    return chunk_pages(pages, MAX_CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, count_model_tokens)
+
 
 def embed_chunks(chunks: List[str]) -> List[List[float]]:
-    return model.encode(chunks, normalize_embeddings=True).tolist()
+    return get_embedder().embed(chunks)
 
 
-def save_chroma(chunks: List[str], client=CHROMA, collection=COLLECTION) -> bool:
-    # embeddings = embed_chunks(chunks)
+def save_chroma(chunks: List[Chunk], client=None, collection=None) -> None:
+    client = client or get_chroma()
+    collection = collection or get_collection()
     ids = [f"chunk_{i}" for i in range(len(chunks))]
-    return collection.upsert(documents=chunks, ids=ids)
+    # Remove the chunks of a previous run that no longer exist, so they are not retrieved
+    stale = set(collection.get(include=[])['ids']) - set(ids)
+    if stale:
+        collection.delete(ids=list(stale))
+    # Chroma rejects upserts larger than its maximum batch size
+    batch_size = client.get_max_batch_size()
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        collection.upsert(
+            documents=[chunk.text for chunk in batch],
+            embeddings=embed_chunks([chunk.text for chunk in batch]),
+            metadatas=[chunk.metadata() for chunk in batch],
+            ids=ids[start:start + batch_size],
+        )
 
 
 if __name__ == '__main__':
-    output_path = create_markdown(
-        Path('../data/pdf/Medication_Side_Effect_Flyer.pdf')
+    parser = argparse.ArgumentParser(description='Index the text of a PDF in Chroma')
+    parser.add_argument(
+        '--pdf', type=Path, default=Path('../data/pdf/Medication_Side_Effect_Flyer.pdf')
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=BATCH_SIZE, help='Chunks embedded per batch'
     )
+    parser.add_argument(
+        '--threads', type=int, default=None, help='CPU threads of the embedding model'
+    )
+    args = parser.parse_args()
+    if args.threads:
+        set_threads(args.threads)
+    get_embedder().batch_size = args.batch_size
+
+    filename = args.pdf
+    pages = extract_pages(filename)
+    output_path = create_markdown(filename, pages)
 
     print(f"Results written to {output_path}")
 
-    with output_path.open("r") as f:
-        chunks = chunk_text(f.read())
+    chunks = chunk_document(pages)
+    save_chroma(chunks)
 
-        save_chroma(chunks)
+    print(f"Indexed {len(chunks)} chunks of {len(pages)} pages")
 
     # pymupdf
     # chunk up using minilm
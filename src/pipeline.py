@@ -0,0 +1,213 @@
+"""
+Run the extraction and graph building scripts as one pipeline.
+
+Every stage declares the script it runs, the files it reads and writes, and the stages it
+must follow. Stages whose dependencies are done run in parallel, so for example the PDF is
+indexed while the images are being extracted. A stage is skipped when its fingerprint,
+the hash of its command, its input files and the fingerprints of the stages it follows, is
+the one recorded after its last successful run, its outputs still exist and no stage it
+follows ran. A stage that follows a stage which ran is therefore always run again too.
+Run from this directory: uv run pipeline.py [stage ...] [--force] [--dry-run]
+"""
+
+import argparse
+import hashlib
+import json
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+STATE_PATH = Path("pipeline_state.json")
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    inputs: list[str]
+    outputs: list[str]
+    after: list[str] = field(default_factory=list)
+    args: list[str] = field(default_factory=list)
+
+    @property
+    def command(self) -> list[str]:
+        return [sys.executable, self.script, *self.args]
+
+
+STAGES = [
+    Stage(
+        "extract_images",
+        "image_extractor.py",
+        inputs=["../data/img/drugs_*.png", "baml_src/*.baml", "image_preprocessing.py"],
+        outputs=["../data/extracted_data/drugs_*json"],
+    ),
+    Stage(
+        "extract_notes",
+        "notes_extractor.py",
+        inputs=["../data/text/notes_*.txt", "baml_src/*.baml"],
+        outputs=["../data/extracted_data/notes.*json"],
+    ),
+    Stage(
+        "index_pdf",
+        "pdf_extractor.py",
+        inputs=["../data/pdf/*.pdf", "chunking.py", "embeddings.py"],
+        outputs=["../data/extracted_data/*.md", "chroma_db"],
+    ),
+    Stage(
+        "drug_graph",
+        "01_create_drug_graph.py",
+        inputs=["../data/extracted_data/drugs*json"],
+        outputs=["ex_kuzu_db"],
+        after=["extract_images"],
+    ),
+    Stage(
+        "patient_graph",
+        "02_create_patient_graph.py",
+        inputs=["../data/extracted_data/notes.json", "entity_resolution.py"],
+        outputs=["ex_kuzu_db"],
+        # The drug graph is rebuilt from scratch, which also removes the patients
+        after=["drug_graph", "extract_notes"],
+    ),
+]
+
+
+def expand(patterns: list[str]) -> list[Path]:
+    """Resolve the glob patterns of a stage to the sorted files and directories they match"""
+    paths = set()
+    for pattern in patterns:
+        paths.update(Path().glob(pattern))
+    return sorted(paths)
+
+
+def fingerprint(stage: Stage, upstream: list[str]) -> str:
+    """Hash the command, the input files (and the script itself) and the upstream fingerprints"""
+    digest = hashlib.sha256(json.dumps([stage.command[1:], upstream]).encode())
+    for path in expand([stage.script, *stage.inputs]):
+        if path.is_file():
+            digest.update(str(path).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def load_state() -> dict[str, str]:
+    return json.loads(STATE_PATH.read_text()) if STATE_PATH.exists() else {}
+
+
+def save_state(state: dict[str, str]) -> None:
+    STATE_PATH.write_text(json.dumps(state, indent=4))
+
+
+def select_stages(names: list[str], with_dependencies: bool = True) -> list[Stage]:
+    """The requested stages and, by default, every stage they follow, in declaration order"""
+    by_name = {stage.name: stage for stage in STAGES}
+    unknown = set(names) - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    selected = set()
+    pending = list(names or by_name)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            if with_dependencies:
+                pending.extend(by_name[name].after)
+    return [stage for stage in STAGES if stage.name in selected]
+
+
+def run_stage(stage: Stage) -> subprocess.CompletedProcess:
+    return subprocess.run(stage.command, capture_output=True, text=True)
+
+
+def run_pipeline(
+    stages: list[Stage], force: bool = False, dry_run: bool = False, max_workers: int = 4
+) -> bool:
+    """
+    Run the stages in dependency order, in parallel where possible; return True on success.
+    Stages followed by a stage but not given are taken as they were after their last run.
+    """
+    state = load_state()
+    selected = {stage.name for stage in stages}
+    fingerprints: dict[str, str] = {}
+    done: set[str] = set()
+    # Stages run (or that would run) in this invocation; the stages following them run too
+    ran: set[str] = set()
+    failed: set[str] = set()
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for stage in list(pending):
+                if any(name in failed for name in stage.after):
+                    print(f"[{stage.name}] not run because a stage it follows failed")
+                    failed.add(stage.name)
+                    pending.remove(stage)
+                    continue
+                if not all(name in done or name not in selected for name in stage.after):
+                    continue
+                pending.remove(stage)
+                upstream = [fingerprints.get(name, state.get(name, "")) for name in stage.after]
+                fingerprints[stage.name] = fingerprint(stage, upstream)
+                outputs_exist = all(expand([pattern]) for pattern in stage.outputs)
+                if (
+                    not force
+                    and outputs_exist
+                    and state.get(stage.name) == fingerprints[stage.name]
+                    and not ran.intersection(stage.after)
+                ):
+                    print(f"[{stage.name}] up to date, skipped")
+                    done.add(stage.name)
+                elif dry_run:
+                    print(f"[{stage.name}] would run: {' '.join(stage.command[1:])}")
+                    ran.add(stage.name)
+                    done.add(stage.name)
+                else:
+                    print(f"[{stage.name}] running {' '.join(stage.command[1:])}")
+                    ran.add(stage.name)
+                    running[executor.submit(run_stage, stage)] = stage
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages in a cycle: {', '.join(s.name for s in pending)}")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                result = future.result()
+                output = (result.stdout + result.stderr).strip()
+                if output:
+                    print("\n".join(f"[{stage.name}] {line}" for line in output.splitlines()))
+                if result.returncode != 0:
+                    print(f"[{stage.name}] failed with exit code {result.returncode}")
+                    failed.add(stage.name)
+                    continue
+                done.add(stage.name)
+                # Record each stage as soon as it succeeds, so a failed run can be resumed
+                state[stage.name] = fingerprints[stage.name]
+                save_state(state)
+
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        help="Stages to bring up to date, with the stages they follow (default: all)",
+    )
+    parser.add_argument(
+        "--only",
+        action="store_true",
+        help="Run just the given stages, without bringing the stages they follow up to date",
+    )
+    parser.add_argument("--force", action="store_true", help="Run stages even if unchanged")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would run")
+    parser.add_argument("--max-workers", type=int, default=4, help="Stages to run at once")
+    args = parser.parse_args()
+
+    stages = select_stages(args.stages, with_dependencies=not args.only)
+    ok = run_pipeline(stages, args.force, args.dry_run, args.max_workers)
+    sys.exit(0 if ok else 1)
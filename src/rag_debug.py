@@ -17,7 +17,7 @@ rag = get_graph_rag()
 
 # @st.cache_resource
 def get_semantic_rag():
-    return SemanticRAG()
+    return SemanticRAG(warm_up=True)
 
 sem_rag = get_semantic_rag()
 
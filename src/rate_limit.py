@@ -0,0 +1,296 @@
+"""
+Client-side rate limiting of BAML calls across LLM providers.
+
+Every provider is a BAML client (see baml_src/clients.baml) with a budget of requests and
+tokens per minute, each tracked by a token bucket that refills continuously. A call reserves
+one request and an estimate of its tokens from the provider with the most quota left, and is
+routed to that client with a `ClientRegistry`. When no provider has room, calls queue in
+arrival order until one does. A provider that still answers with HTTP 429 is paused for a
+while, so the load moves to the others instead of piling up retries on it.
+
+The clients a call can be routed to should serve the same model: the LLM cache is keyed by
+the client of the BAML function, not by the client a call was routed to.
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable
+
+from baml_py import ClientRegistry
+from baml_py.errors import BamlClientHttpError
+
+# Estimated tokens of an image input and of a response, as the real counts are only known after
+# the call; a tile of a downsampled table is around a thousand vision tokens
+IMAGE_TOKENS = 1000
+OUTPUT_TOKENS = 1000
+RATE_LIMITED_PAUSE = 30.0
+
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text; a budget only needs an estimate
+    return len(text) // 4 + 1
+
+
+def estimate_call_tokens(args: tuple) -> int:
+    """Estimate the input and output tokens of a call on `args`"""
+    tokens = OUTPUT_TOKENS
+    for arg in args:
+        tokens += estimate_tokens(arg) if isinstance(arg, str) else IMAGE_TOKENS
+    return tokens
+
+
+class TokenBucket:
+    """A budget of `per_minute` units that refills continuously, up to a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available"""
+        # A request larger than the whole bucket only waits for a full one
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+
+@dataclass
+class Provider:
+    """A BAML client and its budget of requests and tokens per minute"""
+
+    client: str
+    rpm: float
+    tpm: float
+    requests: TokenBucket = field(init=False)
+    tokens: TokenBucket = field(init=False)
+    paused_until: float = 0.0
+    calls: int = 0
+
+    def __post_init__(self):
+        self.requests = TokenBucket(self.rpm)
+        self.tokens = TokenBucket(self.tpm)
+        self.registry = ClientRegistry()
+        self.registry.set_primary(self.client)
+
+    def headroom(self) -> float:
+        """The fraction of the tighter of the two budgets that is left"""
+        return min(
+            self.requests.level / self.requests.capacity, self.tokens.level / self.tokens.capacity
+        )
+
+
+def parse_provider(spec: str) -> Provider:
+    """Parse a `client:rpm:tpm` provider spec, e.g. `OpenRouterGPT4oMini:500:200000`"""
+    try:
+        client, rpm, tpm = spec.split(":")
+        return Provider(client, float(rpm), float(tpm))
+    except ValueError:
+        raise ValueError(f"Provider {spec!r} is not of the form client:rpm:tpm") from None
+
+
+def rate_limiter(specs: list[str] | None = None) -> "RateLimiter | None":
+    """
+    A rate limiter over the providers given as `client:rpm:tpm` specs, or listed
+    comma-separated in the LLM_PROVIDERS environment variable; None if there are none.
+    """
+    if specs is None:
+        specs = os.environ.get("LLM_PROVIDERS", "").split(",")
+    providers = [parse_provider(spec.strip()) for spec in specs if spec.strip()]
+    return RateLimiter(providers) if providers else None
+
+
+class RateLimiter:
+    """Schedule calls across providers within their request and token budgets."""
+
+    def __init__(self, providers: list[Provider], rate_limited_pause: float = RATE_LIMITED_PAUSE):
+        if not providers:
+            raise ValueError("A rate limiter needs at least one provider")
+        self.providers = providers
+        self.rate_limited_pause = rate_limited_pause
+        self._lock = threading.Lock()
+        # Only the caller at the head of the queue reserves, so waiting calls run in order
+        self._async_queue = asyncio.Lock()
+        self._sync_queue = threading.Lock()
+        self.waited = 0.0
+
+    def try_reserve(self, tokens: int) -> tuple[Provider | None, float]:
+        """Reserve a call on the provider with the most headroom, or return how long to wait"""
+        with self._lock:
+            now = time.monotonic()
+            ready, wait = [], float("inf")
+            for provider in self.providers:
+                provider.requests.refill(now)
+                provider.tokens.refill(now)
+                delay = max(
+                    provider.paused_until - now,
+                    provider.requests.wait_time(1),
+                    provider.tokens.wait_time(tokens),
+                )
+                if delay <= 0:
+                    ready.append(provider)
+                wait = min(wait, delay)
+            if not ready:
+                return None, wait
+            provider = max(ready, key=Provider.headroom)
+            provider.requests.level -= 1
+            provider.tokens.level -= min(tokens, provider.tokens.capacity)
+            provider.calls += 1
+            return provider, 0.0
+
+    async def acquire(self, tokens: int) -> Provider:
+        async with self._async_queue:
+            while True:
+                provider, wait = self.try_reserve(tokens)
+                if provider is not None:
+                    return provider
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: int) -> Provider:
+        with self._sync_queue:
+            while True:
+                provider, wait = self.try_reserve(tokens)
+                if provider is not None:
+                    return provider
+                self.waited += wait
+                time.sleep(wait)
+
+    @contextmanager
+    def watch(self, provider: Provider):
+        """Pause a provider that answers a call with HTTP 429 despite its budget"""
+        try:
+            yield
+        except BamlClientHttpError as e:
+            if e.status_code == 429:
+                with self._lock:
+                    provider.paused_until = time.monotonic() + self.rate_limited_pause
+            raise
+
+    def report(self) -> str:
+        calls = ", ".join(f"{provider.client} {provider.calls}" for provider in self.providers)
+        return f"Rate limiter: calls by provider: {calls}; {self.waited:.1f}s spent waiting"
+
+
+def routed(provider: Provider, baml_options: dict | None) -> dict:
+    """The `baml_options` of a call, routed to the client of `provider`"""
+    return {**(baml_options or {}), "client_registry": provider.registry}
+
+
+class RateLimitedClient:
+    """
+    Wrap a generated `BamlSyncClient` or `BamlAsyncClient`, so that every call of a BAML
+    function waits for a provider and is routed to it.
+
+    `reserve` waits for the provider first and returns a client for one call routed to it,
+    so a timeout around that call does not include the time spent waiting for quota.
+    """
+
+    def __init__(self, client, limiter: RateLimiter, provider: Provider | None = None):
+        self.client = client
+        self.limiter = limiter
+        self.provider = provider
+
+    async def reserve(self, *args) -> "RateLimitedClient":
+        """This client, with a provider reserved for one call on `args`"""
+        provider = await self.limiter.acquire(estimate_call_tokens(args))
+        return RateLimitedClient(self.client, self.limiter, provider)
+
+    def reserve_sync(self, *args) -> "RateLimitedClient":
+        provider = self.limiter.acquire_sync(estimate_call_tokens(args))
+        return RateLimitedClient(self.client, self.limiter, provider)
+
+    @property
+    def stream(self) -> "RateLimitedStreamClient":
+        return RateLimitedStreamClient(self.client.stream, self.limiter, self.provider)
+
+    def __getattr__(self, function: str):
+        call = getattr(self.client, function)
+        limiter = self.limiter
+        reserved = self.provider
+        if inspect.iscoroutinefunction(call):
+
+            async def limited_call(*args, baml_options: dict | None = None):
+                provider = reserved or await limiter.acquire(estimate_call_tokens(args))
+                with limiter.watch(provider):
+                    return await call(*args, baml_options=routed(provider, baml_options))
+
+        else:
+
+            def limited_call(*args, baml_options: dict | None = None):
+                provider = reserved or limiter.acquire_sync(estimate_call_tokens(args))
+                with limiter.watch(provider):
+                    return call(*args, baml_options=routed(provider, baml_options))
+
+        return limited_call
+
+
+class RateLimitedStreamClient:
+    """The `.stream` functions of a rate limited client"""
+
+    def __init__(self, stream_client, limiter: RateLimiter, provider: Provider | None = None):
+        self.stream_client = stream_client
+        self.limiter = limiter
+        self.provider = provider
+
+    def __getattr__(self, function: str):
+        stream = getattr(self.stream_client, function)
+
+        def limited_stream(*args, baml_options: dict | None = None) -> RateLimitedStream:
+            def start(provider: Provider):
+                return stream(*args, baml_options=routed(provider, baml_options))
+
+            return RateLimitedStream(self.limiter, start, estimate_call_tokens(args), self.provider)
+
+        return limited_stream
+
+
+class RateLimitedStream:
+    """A BAML stream that only starts its call once a provider has been reserved for it."""
+
+    def __init__(
+        self, limiter: RateLimiter, start: Callable, tokens: int, provider: Provider | None = None
+    ):
+        self.limiter = limiter
+        self.start = start
+        self.tokens = tokens
+        # Set when the provider was reserved beforehand
+        self.provider = provider
+        self.stream = None
+
+    async def __aiter__(self):
+        if self.stream is None:
+            self.provider = self.provider or await self.limiter.acquire(self.tokens)
+            self.stream = self.start(self.provider)
+        with self.limiter.watch(self.provider):
+            async for partial in self.stream:
+                yield partial
+
+    def __iter__(self):
+        if self.stream is None:
+            self.provider = self.provider or self.limiter.acquire_sync(self.tokens)
+            self.stream = self.start(self.provider)
+        with self.limiter.watch(self.provider):
+            yield from self.stream
+
+    async def _await_final_response(self, final):
+        with self.limiter.watch(self.provider):
+            return await final
+
+    def get_final_response(self):
+        if self.stream is None:
+            raise RuntimeError("Iterate a rate limited stream before getting its final response")
+        with self.limiter.watch(self.provider):
+            final = self.stream.get_final_response()
+        # The final response of an async stream is awaited by the caller
+        if inspect.isawaitable(final):
+            return self._await_final_response(final)
+        return final
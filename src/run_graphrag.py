@@ -1,6 +1,10 @@
 import kuzu
 
-from baml_client import b, types
+from baml_client import b as sync_client
+from baml_client import types
+from llm_metrics import METRICS, AccountedClient
+
+b = AccountedClient(sync_client)
 
 
 def get_schema_dict(conn: kuzu.Connection) -> dict[str, list[dict]]:
@@ -15,6 +19,9 @@ def get_schema_dict(conn: kuzu.Connection) -> dict[str, list[dict]]:
         node_properties = conn.execute(f"CALL TABLE_INFO('{node}') RETURN *;")
         while node_properties.has_next():
             row = node_properties.get_next()
+            # Integer surrogate keys mean nothing to the LLM, which should query by name
+            if row[1] == "id":
+                continue
             node_schema["properties"].append({"name": row[1], "type": row[2]})
         schema["nodes"].append(node_schema)
 
@@ -113,3 +120,4 @@ if __name__ == "__main__":
     for question in questions:
         results = rag.run(question)
         print(results)
+    print(METRICS.summary())
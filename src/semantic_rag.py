@@ -1,15 +1,22 @@
-from baml_client import b, types
+from baml_client import b as sync_client, types
 
 from baml_client.types import Chunk
-from pdf_extractor import COLLECTION, CHROMA
+from llm_metrics import AccountedClient
+from embeddings import get_embedder
+from pdf_extractor import get_collection, warm_up_index
+
+b = AccountedClient(sync_client)
 
 
 class SemanticRAG:
-    def __init__(self):
-        self.collection = COLLECTION
+    def __init__(self, warm_up: bool = False):
+        # The embedding model and Chroma load on the first question, or in the background now
+        if warm_up:
+            warm_up_index()
     def run(self, question: str, depth: int = 2) -> dict[str, str]:
-        results = self.collection.query(
-            query_texts=[question],
+        results = get_collection().query(
+            # Embedded with the model of the indexed chunks
+            query_embeddings=get_embedder().embed([question]),
             n_results=depth
         )
 
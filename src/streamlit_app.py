@@ -1,5 +1,8 @@
+import os
+
 import streamlit as st
 
+from llm_metrics import METRICS
 from run_graphrag import GraphRAG
 
 # Set page configuration
@@ -45,6 +48,16 @@ def get_graph_rag():
 
 rag = get_graph_rag()
 
+
+# Serve the LLM call metrics for Prometheus once per process, not on every rerun
+@st.cache_resource
+def serve_llm_metrics(port: int):
+    return METRICS.serve(port)
+
+
+if os.environ.get("LLM_METRICS_PORT"):
+    serve_llm_metrics(int(os.environ["LLM_METRICS_PORT"]))
+
 # App title
 st.title("Graph RAG with Kuzu")
 